@@ -0,0 +1,86 @@
+"""
+Benchmark: ContentEngine.extract_proxies (single scan) vs the original triple-scan
+implementation on large multi-config posts. Fails if the extracted sets differ.
+
+    python benchmarks/bench_extract_proxies.py [--sizes 10,100,500,2000] [--rounds 5]
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import ContentEngine  # noqa: E402
+
+
+def legacy_extract_proxies(raw_text: str) -> list:
+    """The pre-single-scan implementation, kept verbatim for comparison."""
+    cls = ContentEngine
+    if not raw_text: return []
+    sanitized_text = cls.sanitize_text(raw_text)
+    results = []
+    results.extend(cls.PROTOCOL_PATTERN.findall(raw_text))
+    results.extend(cls.MTPROTO_PATTERN.findall(raw_text))
+    results.extend(cls.PROTOCOL_PATTERN.findall(sanitized_text))
+    cleaned_results = []
+    for p in results:
+        p = p.strip(").], ")
+        if len(p) < 10: continue
+        if p.lower().startswith('http'):
+            if any(x in p.lower() for x in ['t.me', 'instagram.com', 'youtube.com', 'twitter.com', 'x.com']):
+                continue
+        cleaned_results.append(p)
+    return list(set(cleaned_results))
+
+
+def random_config(rng: random.Random) -> str:
+    host = f"{rng.choice(['de', 'nl', 'fi', 'us'])}{rng.randint(1, 999)}.example-cdn.net"
+    uid = "%08x-%04x-%04x-%04x-%012x" % tuple(rng.getrandbits(b) for b in (32, 16, 16, 16, 48))
+    kind = rng.choice(["vless", "trojan", "ss", "vmess", "hysteria2"])
+    if kind == "vmess":
+        blob = json.dumps({"v": "2", "ps": f"node-{rng.randint(1, 99)}", "add": host, "port": "443", "id": uid})
+        return "vmess://" + base64.b64encode(blob.encode()).decode()
+    if kind == "ss":
+        return f"ss://{base64.b64encode(f'aes-256-gcm:{uid}'.encode()).decode()}@{host}:8388#🇩🇪 Node"
+    return f"{kind}://{uid}@{host}:443?security=tls&type=ws&sni={host}#@V2rrayVPN-{rng.randint(1, 500)}"
+
+
+def build_post(n_configs: int, rng: random.Random) -> str:
+    lines = ["🔥 کانفیگ‌های جدید امروز (سرعت بالا)", ""]
+    configs = []
+    for _ in range(n_configs):
+        # Real dumps repeat configs and wrap some in brackets or code blocks
+        cfg = rng.choice(configs) if configs and rng.random() < 0.1 else random_config(rng)
+        configs.append(cfg)
+        lines.append(rng.choice([cfg, f"`{cfg}`", f"({cfg})", cfg]))
+    lines += ["", "📢 عضو شوید: https://t.me/V2rrayVPN", "https://instagram.com/v2ray_free"]
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10,100,500,2000")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    for size in map(int, args.sizes.split(",")):
+        post = build_post(size, rng)
+        if set(legacy_extract_proxies(post)) != set(ContentEngine.extract_proxies(post)):
+            print(f"❌ extracted sets differ for a {size}-config post")
+            sys.exit(1)
+
+        repeat = max(1, 2000 // size)
+        old = min(timeit.repeat(lambda: legacy_extract_proxies(post), number=repeat, repeat=args.rounds)) / repeat
+        new = min(timeit.repeat(lambda: ContentEngine.extract_proxies(post), number=repeat, repeat=args.rounds)) / repeat
+        print(f"{size:>5} configs ({len(post) / 1024:7.1f} KiB): legacy {old * 1e3:8.3f} ms | "
+              f"single-scan {new * 1e3:8.3f} ms | {old / new:5.2f}x | {new / size * 1e6:6.2f} µs/config")
+
+
+if __name__ == "__main__":
+    main()
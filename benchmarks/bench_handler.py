@@ -0,0 +1,118 @@
+"""
+Benchmark: per-event cost of the live update handler (routing table + discovery
+registry) vs the original inline routing, on a mix of source and unknown-chat traffic.
+
+    python benchmarks/bench_handler.py [--events 200000] [--unknown-share 0.7] [--unknown-chats 500]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import Config, DiscoveryRegistry, EditTracker, make_event_handler  # noqa: E402
+
+
+class StubPipeline:
+    """Counts ingested items instead of queueing them"""
+    def __init__(self, config: Config):
+        self.discovery = DiscoveryRegistry(config.DISCOVERY_CACHE_SIZE, config.DISCOVERY_TTL)
+        self.edits = EditTracker(config.EDIT_CACHE_SIZE, config.EDIT_CACHE_TTL)
+        self.cluster = None
+        self.metrics = {"edits_skipped": 0}
+        self.ingested = 0
+
+    async def ingest(self, payload, wait=False):
+        self.ingested += 1
+
+
+def legacy_payload(config: Config, chat_id: int, msg) -> dict:
+    """The pre-routing-table build_payload, kept verbatim for comparison."""
+    is_proxy = chat_id in config.PROXY_SOURCES
+    is_news = chat_id in config.NEWS_SOURCES
+    payload = {
+        'source': config.PROXY_SOURCES.get(chat_id) or config.NEWS_SOURCES.get(chat_id),
+        'text': msg.text or "",
+        'msg_obj': msg,
+        'type': 'raw_proxy' if is_proxy else 'raw_news',
+        'chat_id': chat_id,
+        'msg_id': msg.id,
+    }
+    if is_proxy and msg.file and msg.file.name:
+        if any(msg.file.name.lower().endswith(ext) for ext in config.PROXY_FILE_EXTENSIONS):
+            payload['file_name'] = msg.file.name.lower()
+            payload['file_size'] = msg.file.size
+    if is_news:
+        payload['is_heavy'] = bool(msg.video or msg.gif)
+    return payload
+
+
+def make_legacy_handler(config: Config, pipeline: StubPipeline):
+    """The original handler body from main(), kept verbatim for comparison."""
+    async def handler(event):
+        chat_id = event.chat_id
+        is_proxy = chat_id in config.PROXY_SOURCES
+        is_news = chat_id in config.NEWS_SOURCES
+        if not is_proxy and not is_news:
+            chat_title = "Unknown"
+            if event.chat:
+                if hasattr(event.chat, 'title'):
+                    chat_title = event.chat.title
+                elif hasattr(event.chat, 'first_name'):
+                    chat_title = event.chat.first_name
+            await pipeline.ingest({'type': 'discovery', 'chat_id': chat_id, 'title': chat_title or "Unknown"})
+            return
+        await pipeline.ingest(legacy_payload(config, chat_id, event.message))
+    return handler
+
+
+def build_events(config: Config, n: int, unknown_share: float, unknown_chats: int, seed: int = 11) -> list:
+    rng = random.Random(seed)
+    sources = list(dict.fromkeys(list(config.NEWS_SOURCES) + list(config.PROXY_SOURCES)))
+    groups = [-1009000000000 - i for i in range(unknown_chats)]
+    events = []
+    for i in range(n):
+        chat_id = rng.choice(groups) if rng.random() < unknown_share else rng.choice(sources)
+        msg = SimpleNamespace(text=f"message {i}", id=i, media=None, file=None, video=None, gif=None, document=None, photo=None)
+        chat = SimpleNamespace(title=f"Group {chat_id}") if rng.random() < 0.9 else None
+        events.append(SimpleNamespace(chat_id=chat_id, chat=chat, message=msg))
+    return events
+
+
+async def run(handler, events: list) -> float:
+    started = time.perf_counter()
+    for event in events:
+        await handler(event)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--unknown-share", type=float, default=0.7)
+    parser.add_argument("--unknown-chats", type=int, default=500)
+    args = parser.parse_args()
+
+    config = Config(API_ID=0, API_HASH="", STRING_SESSION="", TARGET_CHANNEL=0, MONGO_URI="")
+    config.JOURNAL_ENABLED = False
+    events = build_events(config, args.events, args.unknown_share, args.unknown_chats)
+
+    results = {}
+    for name, factory in (("legacy", make_legacy_handler), ("current", make_event_handler)):
+        pipeline = StubPipeline(config)
+        elapsed = asyncio.run(run(factory(config, pipeline), events))
+        results[name] = elapsed
+        print(f"{name:>8}: {elapsed / len(events) * 1e6:6.2f} µs/event | "
+              f"{len(events) / elapsed:9.0f} events/s | {pipeline.ingested:7d} items queued")
+
+    print(f" speedup: {results['legacy'] / results['current']:.2f}x "
+          f"({args.unknown_share:.0%} of {len(events)} events from {args.unknown_chats} unknown chats)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Benchmark: history documents in the legacy layout (hex content_hash + unique index +
+TTL on created_at) vs history_v2 (16-byte binary _id, int source, TTL only).
+Always reports BSON bytes per document and per index key. With a reachable mongod
+it also reports insert latency through HistoryBatchWriter and the collStats
+data/index sizes, using a scratch database that is dropped afterwards.
+
+    python benchmarks/bench_history.py [--docs 50000] [--writers 3] [--mongo mongodb://localhost:27017]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+import bson
+import motor.motor_asyncio
+import pymongo.errors
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import Config, ContentEngine, Database, HistoryBatchWriter  # noqa: E402
+from bench_pipeline import percentiles  # noqa: E402
+
+SCRATCH_DB = "newsradar_bench_history"
+
+
+def build_rows(n: int, seed: int = 3) -> list:
+    """(content_hash, source name, simhash or None) as the DB stage would produce them"""
+    rng = random.Random(seed)
+    config = Config(API_ID=0, API_HASH="", STRING_SESSION="", TARGET_CHANNEL=0, MONGO_URI="")
+    names = list(config.NEWS_SOURCES.values()) + list(config.PROXY_SOURCES.values())
+    rows = []
+    for i in range(n):
+        h = ContentEngine.get_content_hash(f"post {i} {rng.getrandbits(64)}")
+        simhash = rng.getrandbits(64) if rng.random() < 0.6 else None
+        rows.append((h, rng.choice(names), simhash))
+    return rows
+
+
+def signed(simhash: int) -> int:
+    return simhash - (1 << 64) if simhash >= (1 << 63) else simhash
+
+
+def legacy_doc(h: str, source: str, simhash, now: datetime) -> dict:
+    doc = {"content_hash": h, "source": source, "created_at": now}
+    if simhash is not None: doc["simhash"] = signed(simhash)
+    return doc
+
+
+def compact_doc(h: str, source_id: int, simhash, now: datetime) -> dict:
+    doc = {"_id": Database.history_key(h), "s": source_id, "t": now}
+    if simhash is not None: doc["f"] = signed(simhash)
+    return doc
+
+
+def build_docs(rows: list) -> dict:
+    now = datetime.now(timezone.utc)
+    source_ids = {}
+    return {
+        "legacy": [legacy_doc(h, source, fp, now) for h, source, fp in rows],
+        "compact": [compact_doc(h, source_ids.setdefault(source, len(source_ids) + 1), fp, now)
+                    for h, source, fp in rows],
+    }
+
+
+def offline_report(docs: dict):
+    # An inserted legacy document also carries the ObjectId _id the driver adds
+    legacy_bytes = sum(len(bson.encode({"_id": bson.ObjectId(), **d})) for d in docs["legacy"]) / len(docs["legacy"])
+    compact_bytes = sum(len(bson.encode(d)) for d in docs["compact"]) / len(docs["compact"])
+    print(f"   BSON/doc: legacy {legacy_bytes:6.1f} B | compact {compact_bytes:6.1f} B "
+          f"({legacy_bytes / compact_bytes:.2f}x smaller)")
+    # Index key payloads, ignoring the record id WiredTiger stores next to each key
+    print("index keys: legacy _id 12 B + content_hash 64 B + created_at 8 B | compact _id 16 B + t 8 B")
+
+
+async def insert_all(collection, docs: list, writers: int, config: Config) -> list:
+    writer = HistoryBatchWriter(collection, config.HISTORY_BATCH_SIZE, config.HISTORY_BATCH_LINGER_MS)
+    it = iter(docs)
+    latencies = []
+
+    async def worker():
+        for doc in it:
+            started = time.perf_counter()
+            await writer.submit(doc)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(worker() for _ in range(writers)))
+    return latencies
+
+
+async def online_report(uri: str, docs: dict, writers: int) -> dict:
+    client = motor.motor_asyncio.AsyncIOMotorClient(uri, serverSelectionTimeoutMS=2000)
+    try:
+        await client.admin.command("ping")
+    except pymongo.errors.PyMongoError as e:
+        print(f"(no mongod at {uri}: {e.__class__.__name__}; skipping insert latency and collStats)")
+        return {}
+    config = Config(API_ID=0, API_HASH="", STRING_SESSION="", TARGET_CHANNEL=0, MONGO_URI=uri)
+    db = client[SCRATCH_DB]
+    results = {}
+    try:
+        await db.legacy.create_index("created_at", expireAfterSeconds=Config.DUPLICATE_TTL)
+        await db.legacy.create_index("content_hash", unique=True)
+        await db.compact.create_index("t", expireAfterSeconds=Config.DUPLICATE_TTL)
+        for name in ("legacy", "compact"):
+            latencies = await insert_all(db[name], [dict(d) for d in docs[name]], writers, config)
+            stats = await db.command("collStats", name)
+            results[name] = r = {"insert": percentiles(latencies), "count": stats["count"],
+                                 "avg_obj_bytes": stats.get("avgObjSize", 0), "data_bytes": stats["size"],
+                                 "storage_bytes": stats["storageSize"], "index_bytes": stats["totalIndexSize"],
+                                 "index_sizes": stats["indexSizes"]}
+            ins = r["insert"]
+            print(f"{name:>8}: insert p50 {ins['p50_ms']:6.2f} ms | p95 {ins['p95_ms']:6.2f} ms | "
+                  f"p99 {ins['p99_ms']:6.2f} ms | data {r['data_bytes'] / 2**20:6.2f} MiB | "
+                  f"indexes {r['index_bytes'] / 2**20:6.2f} MiB {r['index_sizes']}")
+        legacy, compact = results["legacy"], results["compact"]
+        print(f"   saved: data {(legacy['data_bytes'] - compact['data_bytes']) / 2**20:.2f} MiB | "
+              f"indexes {(legacy['index_bytes'] - compact['index_bytes']) / 2**20:.2f} MiB "
+              f"({legacy['index_bytes'] / max(1, compact['index_bytes']):.2f}x smaller)")
+    finally:
+        await client.drop_database(SCRATCH_DB)
+        client.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--docs", type=int, default=50000)
+    parser.add_argument("--writers", type=int, default=Config.DB_WORKER_COUNT)
+    parser.add_argument("--mongo", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    args = parser.parse_args()
+
+    docs = build_docs(build_rows(args.docs))
+    offline_report(docs)
+    asyncio.run(online_report(args.mongo, docs, args.writers))
+
+
+if __name__ == "__main__":
+    main()
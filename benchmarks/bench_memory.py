@@ -0,0 +1,141 @@
+"""
+Memory benchmark: Python heap (tracemalloc) and peak RSS with every pipeline queue
+full, for the original dict payloads holding Telethon Messages vs the slotted
+IngestItem/PublishItem records. Each variant runs in its own process so RSS is
+not shared between them.
+
+    python benchmarks/bench_memory.py [--ingest 2000] [--publish 1000] [--text-len 1200]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tracemalloc
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon.tl import types  # noqa: E402
+
+from main import Config, PublishItem, build_payload  # noqa: E402
+from bench_handler import legacy_payload  # noqa: E402
+from bench_clean_news import BODY, HEADLINES  # noqa: E402
+
+# Stands in for the TelegramClient a received Message is bound to
+STUB_CLIENT = SimpleNamespace(_self_id=1, _mb_entity_cache=SimpleNamespace(get=lambda _: None), parse_mode=None)
+
+
+def make_message(i: int, chat_id: int, text_len: int, rng: random.Random):
+    """A Message shaped like a received update: entities, a channel entity and media"""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    text = (rng.choice(HEADLINES) + "\n" + " ".join(rng.choice(BODY) for _ in range(40)))[:text_len]
+    if i % 3 == 0:
+        media = types.MessageMediaDocument(document=types.Document(
+            id=rng.getrandbits(63), access_hash=rng.getrandbits(63), file_reference=os.urandom(32), date=now,
+            mime_type="video/mp4", size=rng.randint(10**5, 10**7), dc_id=4,
+            thumbs=[types.PhotoStrippedSize("i", os.urandom(600)), types.PhotoSize("m", 320, 180, 12000)],
+            attributes=[types.DocumentAttributeVideo(duration=30, w=1280, h=720),
+                        types.DocumentAttributeFilename(f"clip_{i}.mp4")]))
+    elif i % 3 == 1:
+        media = types.MessageMediaPhoto(photo=types.Photo(
+            id=rng.getrandbits(63), access_hash=rng.getrandbits(63), file_reference=os.urandom(32), date=now,
+            sizes=[types.PhotoStrippedSize("i", os.urandom(600)), types.PhotoSize("m", 320, 240, 15000),
+                   types.PhotoSize("x", 800, 600, 60000), types.PhotoSizeProgressive("y", 1280, 960, [9000, 30000, 90000])],
+            dc_id=4))
+    else:
+        media = None
+    entities = [types.MessageEntityBold(0, 20), types.MessageEntityTextUrl(30, 10, "https://t.me/example"),
+                types.MessageEntityHashtag(50, 8)]
+    channel_id = -chat_id - 10**12
+    msg = types.Message(id=i, peer_id=types.PeerChannel(channel_id), date=now, message=text, media=media,
+                        entities=entities, views=rng.randint(100, 10**5), post=True,
+                        reply_markup=types.ReplyInlineMarkup([types.KeyboardButtonRow(
+                            [types.KeyboardButtonUrl("عضویت", "https://t.me/example")])]))
+    channel = types.Channel(id=channel_id, title=f"Source {chat_id}", photo=types.ChatPhotoEmpty(), date=now,
+                            access_hash=rng.getrandbits(63), username="example", broadcast=True)
+    msg._finish_init(STUB_CLIENT, {channel_id: channel}, None)
+    return msg
+
+
+def fill_legacy(config: Config, messages, ingest: int) -> list:
+    held = []
+    for n, (chat_id, msg) in enumerate(messages):
+        if n < ingest:
+            held.append(legacy_payload(config, chat_id, msg))
+        else:
+            held.append({'type': 'news', 'text': msg.text, 'msg_obj': msg, 'source': "src", 'is_heavy': bool(msg.video),
+                         'chat_id': chat_id, 'msg_id': msg.id, 'ingested_at': 1.0})
+    return held
+
+
+def fill_current(config: Config, messages, ingest: int) -> list:
+    routes = config.routing_table()
+    held = []
+    for n, (chat_id, msg) in enumerate(messages):
+        item = build_payload(config, routes[chat_id], chat_id, msg)
+        if n >= ingest:
+            item = PublishItem('news', item.source, item.text, item.media, item.chat_id, item.msg_id,
+                               item.is_heavy, 1.0)
+        held.append(item)
+    return held
+
+
+def measure(variant: str, ingest: int, publish: int, text_len: int) -> dict:
+    config = Config(API_ID=0, API_HASH="", STRING_SESSION="", TARGET_CHANNEL=0, MONGO_URI="")
+    sources = list(config.NEWS_SOURCES)
+    rng = random.Random(5)
+    total = ingest + 2 * publish  # ingest queue + fast and slow publish queues
+
+    def messages():
+        # Generated lazily: the pipeline receives them one update at a time
+        for i in range(total):
+            chat_id = rng.choice(sources)
+            yield chat_id, make_message(i, chat_id, text_len, rng)
+
+    fill = fill_legacy if variant == "legacy" else fill_current
+    tracemalloc.start()
+    held = fill(config, messages(), ingest)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "items": len(held),
+        "heap_mib": current / 2**20,
+        "heap_peak_mib": peak / 2**20,
+        "max_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ingest", type=int, default=Config.INGEST_QUEUE_SIZE)
+    parser.add_argument("--publish", type=int, default=Config.PUBLISH_QUEUE_SIZE)
+    parser.add_argument("--text-len", type=int, default=1200)
+    parser.add_argument("--variant", choices=("legacy", "current"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(measure(args.variant, args.ingest, args.publish, args.text_len)))
+        return
+
+    results = {}
+    for variant in ("legacy", "current"):
+        out = subprocess.run([sys.executable, __file__, "--variant", variant, "--ingest", str(args.ingest),
+                              "--publish", str(args.publish), "--text-len", str(args.text_len)],
+                             check=True, capture_output=True, text=True).stdout
+        results[variant] = r = json.loads(out.strip().splitlines()[-1])
+        print(f"{variant:>8}: {r['items']} queued | heap {r['heap_mib']:7.1f} MiB | "
+              f"heap peak {r['heap_peak_mib']:7.1f} MiB | peak RSS {r['max_rss_mib']:7.1f} MiB")
+
+    legacy, current = results["legacy"], results["current"]
+    print(f"   saved: heap {legacy['heap_mib'] - current['heap_mib']:.1f} MiB "
+          f"({legacy['heap_mib'] / current['heap_mib']:.1f}x smaller) | "
+          f"RSS {legacy['max_rss_mib'] - current['max_rss_mib']:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
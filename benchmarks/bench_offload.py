@@ -0,0 +1,102 @@
+"""
+Benchmark: event-loop lag and throughput of the DB stage's CPU work, inline on the
+loop vs offloaded to ContentOffloader (ProcessPoolExecutor). Both modes run with the
+same number of consumers, which pull items the way PipelineManager's DB workers do;
+the sweep covers DB_WORKERS_MIN, DB_WORKER_COUNT and DB_WORKERS_MAX by default.
+
+    python benchmarks/bench_offload.py [--items 2000] [--workers 2] [--batch 32] [--consumers 2 3 16]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import Config, ContentEngine, ContentOffloader  # noqa: E402
+from bench_clean_news import build_corpus  # noqa: E402
+from bench_extract_proxies import build_post  # noqa: E402
+
+TICK = 0.005
+
+
+async def probe_lag(samples: list, stop: asyncio.Event):
+    """Sleeps TICK in a loop and records how late each wake-up is"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        t0 = loop.time()
+        await asyncio.sleep(TICK)
+        samples.append(loop.time() - t0 - TICK)
+
+
+async def run(items: list, consumers: int, offloader: ContentOffloader = None) -> dict:
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in items: queue.put_nowait(item)
+    lag, stop = [], asyncio.Event()
+    blacklist, min_tokens = Config.BLACKLIST, Config.NEAR_DUP_MIN_TOKENS
+
+    async def consumer():
+        while not queue.empty():
+            batch = [queue.get_nowait()]
+            if offloader:
+                # Same pull as PipelineManager._db_processor: this consumer's share of the backlog
+                share = offloader.share(queue.qsize(), consumers)
+                while len(batch) < share and not queue.empty():
+                    batch.append(queue.get_nowait())
+                await offloader.analyze_batch(batch)
+            else:
+                for kind, text in batch: ContentEngine.analyze(kind, text, blacklist, min_tokens)
+            for _ in batch:
+                await asyncio.sleep(0)  # stands in for the Mongo round-trip that follows
+
+    probe = asyncio.create_task(probe_lag(lag, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(consumer() for _ in range(consumers)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+
+    lag.sort()
+    return {
+        "items_per_s": len(items) / elapsed,
+        "lag_p50_ms": statistics.median(lag) * 1e3 if lag else 0.0,
+        "lag_p99_ms": lag[int(len(lag) * 0.99) - 1] * 1e3 if lag else 0.0,
+        "lag_max_ms": lag[-1] * 1e3 if lag else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--consumers", type=int, nargs="+",
+                        default=sorted({Config.DB_WORKERS_MIN, Config.DB_WORKER_COUNT, Config.DB_WORKERS_MAX}))
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    news = build_corpus(args.items)
+    items = [("raw_proxy", build_post(rng.randint(20, 300), rng)) if rng.random() < 0.3 else ("raw_news", text)
+             for text in news]
+    offloader = ContentOffloader(args.workers, args.batch, Config.BLACKLIST, Config.NEAR_DUP_MIN_TOKENS)
+
+    for consumers in args.consumers:
+        offloader.flushes = 0
+        results = {
+            "inline": asyncio.run(run(items, consumers)),
+            "offload": asyncio.run(run(items, consumers, offloader)),
+        }
+        batch = len(items) / max(1, offloader.flushes)
+        for name, r in results.items():
+            note = f" | {batch:5.1f} items/batch" if name == "offload" else ""
+            print(f"{consumers:2d} consumers {name:>8}: {r['items_per_s']:8.0f} items/s | loop lag p50 {r['lag_p50_ms']:6.2f} ms "
+                  f"| p99 {r['lag_p99_ms']:7.2f} ms | max {r['lag_max_ms']:7.2f} ms{note}")
+    offloader.pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
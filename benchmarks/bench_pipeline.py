@@ -0,0 +1,310 @@
+"""
+Synthetic load harness: drives the real PipelineManager (and the real event handler)
+with a fake TelegramClient and an in-memory Database stand-in at a target message
+rate, then reports throughput, drops, queue high-water marks and per-stage latency
+percentiles. Results are written as JSON for comparing runs over time.
+
+    python benchmarks/bench_pipeline.py [--rate 40] [--duration 20] [--send-latency-ms 25]
+        [--db-latency-ms 3] [--flood-rate 0.001] [--dup-rate 0.02] [--out results.json]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pymongo.errors  # noqa: E402
+from telethon import errors  # noqa: E402
+
+from main import (Config, Database, HistoryBatchWriter, LatencyHistogram, PipelineManager,  # noqa: E402
+                  RecentHashCache, logger, make_event_handler)
+from bench_clean_news import build_corpus  # noqa: E402
+from bench_extract_proxies import build_post  # noqa: E402
+
+
+class Latency:
+    """Mean latency with +-50% uniform jitter"""
+    def __init__(self, mean_ms: float, rng: random.Random):
+        self.mean = mean_ms / 1000
+        self.rng = rng
+
+    async def wait(self):
+        if self.mean > 0: await asyncio.sleep(self.mean * self.rng.uniform(0.5, 1.5))
+
+
+class FakeClient:
+    """Stands in for TelegramClient: every send costs a latency and may raise FloodWaitError"""
+    def __init__(self, latency: Latency, flood_rate: float, flood_seconds: int, rng: random.Random):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.rng = rng
+        self.calls = 0
+        self.flood_waits = 0
+
+    def is_connected(self) -> bool:
+        return True
+
+    async def _call(self):
+        self.calls += 1
+        await self.latency.wait()
+        if self.rng.random() < self.flood_rate:
+            self.flood_waits += 1
+            raise errors.FloodWaitError(request=None, capture=self.flood_seconds)
+        return SimpleNamespace(id=self.calls)
+
+    async def send_message(self, *args, **kwargs):
+        return await self._call()
+
+    async def send_file(self, *args, **kwargs):
+        return await self._call()
+
+    async def forward_messages(self, *args, **kwargs):
+        return await self._call()
+
+    async def get_messages(self, chat_id, ids=None):
+        return []
+
+
+class FakeHistory:
+    """history collection: unique _id, injected duplicate-key errors (another instance won)"""
+    def __init__(self, latency: Latency, dup_rate: float, rng: random.Random):
+        self.latency = latency
+        self.dup_rate = dup_rate
+        self.rng = rng
+        self.hashes = set()
+        self.injected_duplicates = 0
+
+    async def insert_many(self, docs, ordered=False):
+        await self.latency.wait()
+        write_errors = []
+        for i, doc in enumerate(docs):
+            h = doc["_id"]
+            if h in self.hashes or self.rng.random() < self.dup_rate:
+                if h not in self.hashes: self.injected_duplicates += 1
+                write_errors.append({"index": i, "code": HistoryBatchWriter.DUPLICATE_KEY_CODE, "errmsg": "E11000"})
+            self.hashes.add(h)
+        if write_errors:
+            raise pymongo.errors.BulkWriteError({"writeErrors": write_errors, "nInserted": len(docs) - len(write_errors)})
+
+
+class InMemoryDatabase(Database):
+    """Database with the real dedup cache and batch writer over FakeHistory; no Mongo client"""
+    def __init__(self, config: Config, latency: Latency, dup_rate: float, rng: random.Random):
+        self.latency = latency
+        self.history = FakeHistory(latency, dup_rate, rng)
+        self.seen_cache = RecentHashCache(config.DEDUP_CACHE_SIZE, Config.DUPLICATE_TTL)
+        self.writer = HistoryBatchWriter(self.history, config.HISTORY_BATCH_SIZE, config.HISTORY_BATCH_LINGER_MS)
+        self.legacy_history = None
+        self.raw_proxy_hashes_until = 0.0
+        self._source_ids = {}
+
+    async def initialize(self): pass
+
+    async def source_id(self, name): return self._source_ids.setdefault(name, len(self._source_ids) + 1)
+
+    async def get_checkpoint(self, chat_id): return None
+
+    async def save_checkpoints(self, positions): await self.latency.wait()
+
+    async def discovery_known(self, chat_id): return False
+
+    async def save_discoveries(self, updates): await self.latency.wait()
+
+    async def load_discoveries(self, limit, ttl): return []
+
+    async def load_fingerprints(self, limit): return []
+
+
+class RecordingHistogram(LatencyHistogram):
+    """Keeps raw samples next to the buckets so the harness can report exact percentiles"""
+    def __init__(self):
+        super().__init__()
+        self.samples = []
+
+    def observe(self, seconds: float):
+        super().observe(seconds)
+        self.samples.append(seconds)
+
+
+def percentiles(samples: list) -> dict:
+    if not samples: return {"count": 0}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1e3  # noqa: E731
+    return {"count": len(ordered), "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+            "max_ms": ordered[-1] * 1e3}
+
+
+def build_stream(config: Config, args, rng: random.Random) -> list:
+    """(chat_id, chat, message) tuples; news repeats some stories to exercise dedup"""
+    news_ids, proxy_ids = list(config.NEWS_SOURCES), [c for c in config.PROXY_SOURCES if c not in config.NEWS_SOURCES]
+    total = int(args.rate * args.duration)
+    corpus = build_corpus(max(1, total // 2), seed=args.seed)
+    groups = [-1009000000000 - i for i in range(args.unknown_chats)]
+    stream = []
+    for i in range(total):
+        roll = rng.random()
+        file = media = None
+        if roll < args.discovery_share:
+            chat_id, text = rng.choice(groups), "chit-chat"
+        elif roll < args.discovery_share + args.proxy_share:
+            chat_id, text = rng.choice(proxy_ids), build_post(rng.randint(1, 5), rng)
+            if rng.random() < 0.1:
+                file = SimpleNamespace(name=f"cfg_{i}.npvt", size=rng.randint(500, 5000))
+                media = SimpleNamespace(kind="document")
+        else:
+            repost = stream and rng.random() < args.repost_share
+            chat_id, text = rng.choice(news_ids), rng.choice(corpus) if repost else corpus[i % len(corpus)]
+            if rng.random() < 0.3: media = SimpleNamespace(kind="photo")
+        msg = SimpleNamespace(id=i + 1, text=text, media=media, file=file, video=None, gif=None, document=None, photo=None)
+        stream.append((chat_id, SimpleNamespace(title=f"Group {chat_id}"), msg))
+    return stream
+
+
+async def sample_queues(pipeline: PipelineManager, high: dict, stop: asyncio.Event):
+    queues = {"ingest": pipeline.ingest_queue, "fast_publish": pipeline.fast_publish_queue,
+              "slow_publish": pipeline.slow_publish_queue}
+    while not stop.is_set():
+        for name, queue in queues.items():
+            high[name] = max(high[name], queue.qsize())
+        await asyncio.sleep(0.01)
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    config = Config(API_ID=0, API_HASH="", STRING_SESSION="", TARGET_CHANNEL=0, MONGO_URI="")
+    config.PUBLISH_RATE = config.PUBLISH_RATE_MAX = args.publish_rate
+    config.PUBLISH_BURST = max(config.PUBLISH_BURST, args.publish_rate)
+    config.MEDIA_BATCH_WINDOW = args.media_window
+    config.CPU_OFFLOAD = args.cpu_offload
+    config.JOURNAL_ENABLED = args.journal
+    tmp = tempfile.TemporaryDirectory()
+    config.JOURNAL_PATH = os.path.join(tmp.name, "journal.db")
+    config.SPILL_PATH = os.path.join(tmp.name, "spill.db")
+
+    client = FakeClient(Latency(args.send_latency_ms, rng), args.flood_rate, args.flood_seconds, rng)
+    db = InMemoryDatabase(config, Latency(args.db_latency_ms, rng), args.dup_rate, rng)
+    pipeline = PipelineManager(client, config, db)
+    pipeline.latency = {stage: RecordingHistogram() for stage in pipeline.LATENCY_STAGES}
+    await pipeline.start_processors()
+    handler = make_event_handler(config, pipeline)
+
+    stream = build_stream(config, args, rng)
+    high = {"ingest": 0, "fast_publish": 0, "slow_publish": 0}
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_queues(pipeline, high, stop))
+
+    # Open loop: events arrive on schedule whether or not the pipeline keeps up
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    for i, (chat_id, chat, msg) in enumerate(stream):
+        delay = started + i / args.rate - loop.time()
+        if delay > 0: await asyncio.sleep(delay)
+        await handler(SimpleNamespace(chat_id=chat_id, chat=chat, message=msg))
+    offered_for = loop.time() - started
+
+    async def drain():
+        for queue in (pipeline.ingest_queue, pipeline.fast_publish_queue, pipeline.slow_publish_queue):
+            await queue.join()
+    drained = True
+    try:
+        await asyncio.wait_for(drain(), args.drain_timeout)
+    except asyncio.TimeoutError:
+        drained = False
+    elapsed = loop.time() - started
+    stop.set()
+    await sampler
+
+    for task in asyncio.all_tasks() - {asyncio.current_task()}:
+        task.cancel()
+    if pipeline.offloader: pipeline.offloader.pool.shutdown(cancel_futures=True)
+    tmp.cleanup()
+
+    m = pipeline.metrics
+    return {
+        "offered": len(stream),
+        "offered_rate": len(stream) / offered_for,
+        "elapsed_s": elapsed,
+        "drained": drained,
+        "ingested": m["ingest_in"],
+        "dropped": m["ingest_drop"],
+        "processed_db": m["processed_db"],
+        "published": m["published"],
+        "throughput_published_per_s": m["published"] / elapsed,
+        "throughput_processed_per_s": m["processed_db"] / elapsed,
+        "near_dup_suppressed": m["near_dup_suppressed"],
+        "album_batches": m["album_batches"],
+        "send_calls": client.calls,
+        "flood_waits": client.flood_waits,
+        "injected_duplicates": db.history.injected_duplicates,
+        "queue_high_water": high,
+        "latency": {stage: percentiles(h.samples) for stage, h in pipeline.latency.items()},
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rate", type=float, default=40, help="offered messages per second")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of offered load")
+    parser.add_argument("--discovery-share", type=float, default=0.3)
+    parser.add_argument("--proxy-share", type=float, default=0.2)
+    parser.add_argument("--repost-share", type=float, default=0.2, help="news that repeats an earlier story")
+    parser.add_argument("--unknown-chats", type=int, default=200)
+    parser.add_argument("--send-latency-ms", type=float, default=25)
+    parser.add_argument("--db-latency-ms", type=float, default=3)
+    parser.add_argument("--flood-rate", type=float, default=0.001, help="FloodWaitError probability per send")
+    parser.add_argument("--flood-seconds", type=int, default=1)
+    parser.add_argument("--dup-rate", type=float, default=0.02, help="injected DuplicateKeyError probability per insert")
+    parser.add_argument("--publish-rate", type=float, default=200, help="scheduler tokens/s (Telegram itself allows far less)")
+    parser.add_argument("--media-window", type=float, default=0.2)
+    parser.add_argument("--cpu-offload", action="store_true")
+    parser.add_argument("--journal", action="store_true", help="enable the SQLite journal (temp dir)")
+    parser.add_argument("--drain-timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="JSON results path (default benchmarks/results/pipeline-<time>.json)")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if not args.verbose: logger.setLevel(logging.ERROR)
+    results = asyncio.run(run(args))
+
+    stamp = datetime.now(timezone.utc)
+    report = {"timestamp": stamp.isoformat(), "revision": git_revision(), "params": vars(args), "results": results}
+    out = args.out or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                   f"pipeline-{stamp.strftime('%Y%m%dT%H%M%SZ')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    r = results
+    print(f"offered {r['offered']} msgs at {r['offered_rate']:.0f}/s | ingested {r['ingested']} | dropped {r['dropped']}"
+          f" | processed {r['throughput_processed_per_s']:.0f}/s | published {r['published']}"
+          f" ({r['throughput_published_per_s']:.0f}/s) | FloodWaits {r['flood_waits']}"
+          f"{'' if r['drained'] else ' | NOT DRAINED'}")
+    print("queue high-water: " + ", ".join(f"{k} {v}" for k, v in r["queue_high_water"].items()))
+    for stage, p in r["latency"].items():
+        if p["count"]:
+            print(f"  {stage:>12}: n={p['count']:6d} p50 {p['p50_ms']:8.2f} ms | p95 {p['p95_ms']:8.2f} ms"
+                  f" | p99 {p['p99_ms']:8.2f} ms")
+    print(f"saved {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark: proxy dedup by raw-URI hash vs ContentEngine.proxy_hash (canonical form,
+memoized) on a repost stream where the same configs come back with a new #remark,
+reordered query params, re-encoded vmess JSON, legacy vs SIP002 ss and host case
+changes. Fails if canonicalization merges two different configs.
+
+    python benchmarks/bench_proxy_canon.py [--configs 2000] [--posts 20000] [--exact-share 0.5]
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import time
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import ContentEngine  # noqa: E402
+
+
+def random_base(rng: random.Random) -> dict:
+    host = f"{rng.choice(['de', 'nl', 'fi', 'us'])}{rng.randint(1, 999)}.example-cdn.net"
+    uid = "%08x-%04x-%04x-%04x-%012x" % tuple(rng.getrandbits(b) for b in (32, 16, 16, 16, 48))
+    kind = rng.choice(["vless", "trojan", "ss", "vmess", "hysteria2"])
+    params = {"security": "tls", "type": "ws", "sni": host, "path": f"/ws{rng.randint(1, 99)}"}
+    return {"kind": kind, "host": host, "uid": uid, "port": rng.choice([443, 8443, 2053]), "params": params}
+
+
+def spell(base: dict, rng: random.Random) -> str:
+    """One of the ways channels repost the same config"""
+    kind, host, uid, port = base["kind"], base["host"], base["uid"], base["port"]
+    remark = f"#@V2rrayVPN-{rng.randint(1, 500)}" if rng.random() < 0.8 else ""
+    if rng.random() < 0.3: host = host.upper()
+    if kind == "vmess":
+        cfg = {"v": rng.choice(["2", 2]), "ps": f"node-{rng.randint(1, 99)}", "add": host,
+               "port": rng.choice([str(port), port]), "id": uid, "aid": rng.choice(["0", 0]), "net": "ws"}
+        items = list(cfg.items())
+        rng.shuffle(items)
+        blob = json.dumps(dict(items), separators=rng.choice([(",", ":"), (", ", ": ")])).encode()
+        encoded = base64.urlsafe_b64encode(blob).decode().rstrip("=") if rng.random() < 0.5 else base64.b64encode(blob).decode()
+        return "vmess://" + encoded
+    if kind == "ss":
+        if rng.random() < 0.5:
+            return f"ss://{base64.b64encode(f'aes-256-gcm:{uid}@{host}:{port}'.encode()).decode()}{remark}"
+        return f"ss://{base64.b64encode(f'aes-256-gcm:{uid}'.encode()).decode()}@{host}:{port}{remark}"
+    params = list(base["params"].items())
+    rng.shuffle(params)
+    query = "&".join(f"{k}={quote(v, safe='') if rng.random() < 0.5 else v}" for k, v in params)
+    return f"{kind}://{uid}@{host}:{port}?{query}{remark}"
+
+
+def build_stream(configs: int, posts: int, exact_share: float, seed: int = 9) -> list:
+    """(config index, uri) pairs; exact_share of reposts copy an earlier string verbatim"""
+    rng = random.Random(seed)
+    bases = [random_base(rng) for _ in range(configs)]
+    stream = []
+    for _ in range(posts):
+        if stream and rng.random() < exact_share:
+            stream.append(rng.choice(stream))
+        else:
+            i = rng.randrange(configs)
+            stream.append((i, spell(bases[i], rng)))
+    return stream
+
+
+def per_uri_us(fn, uris: list) -> float:
+    started = time.perf_counter()
+    for uri in uris: fn(uri)
+    return (time.perf_counter() - started) / len(uris) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--configs", type=int, default=2000)
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--exact-share", type=float, default=0.5)
+    args = parser.parse_args()
+
+    stream = build_stream(args.configs, args.posts, args.exact_share)
+    uris = [uri for _, uri in stream]
+    truth = len({i for i, _ in stream})
+    raw = {ContentEngine.get_content_hash(uri) for uri in uris}
+    ContentEngine.proxy_hash.cache_clear()
+    canonical = {}
+    for i, uri in stream:
+        canonical.setdefault(ContentEngine.proxy_hash(uri), set()).add(i)
+    merged = sum(1 for ids in canonical.values() if len(ids) > 1)
+    if merged:
+        print(f"❌ {merged} canonical hashes cover more than one config")
+        sys.exit(1)
+
+    repeats = len(uris) - truth
+    print(f"{len(uris)} URIs, {truth} distinct configs ({repeats} reposts)")
+    print(f"     raw hash: {len(raw):6d} unique | {(len(uris) - len(raw)) / repeats:6.1%} of reposts caught")
+    print(f"    canonical: {len(canonical):6d} unique | {(len(uris) - len(canonical)) / repeats:6.1%} of reposts caught "
+          f"| {len(raw) - len(canonical)} fewer Mongo writes/publishes")
+
+    distinct = list(dict.fromkeys(uris))
+    raw_us = per_uri_us(ContentEngine.get_content_hash, uris)
+    ContentEngine.proxy_hash.cache_clear()
+    cold_us = per_uri_us(ContentEngine.proxy_hash, distinct)
+    ContentEngine.proxy_hash.cache_clear()
+    stream_us = per_uri_us(ContentEngine.proxy_hash, uris)
+    info = ContentEngine.proxy_hash.cache_info()
+    print(f"per URI: raw hash {raw_us:5.2f} µs | canonical cold {cold_us:5.2f} µs | "
+          f"canonical on stream {stream_us:5.2f} µs (memo hit rate {info.hits / (info.hits + info.misses):.0%})")
+
+
+if __name__ == "__main__":
+    main()
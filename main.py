@@ -11,26 +11,41 @@ Features:
 
 import os
 import asyncio
+import base64
+import binascii
+import bisect
+import functools
 import logging
+import math
 import re
 import hashlib
+import json
 import random
+import socket
+import sqlite3
+import sys
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass, field
 from datetime import datetime, timezone, timedelta
-from typing import Dict, Any, List, Set
+from collections import OrderedDict, Counter, deque
+from typing import Dict, Any, List, Set, Optional
+from urllib.parse import parse_qsl, quote, unquote, urlencode
 
 import motor.motor_asyncio
 import pymongo.errors
-from telethon import TelegramClient, events, errors
+from telethon import TelegramClient, events, errors, utils
 from telethon.sessions import StringSession
 from telethon.tl.types import MessageMediaWebPage
 
 # وب‌سرور برای زنده نگه داشتن در Render
 try:
-    from web_server import keep_alive
+    from web_server import keep_alive, register_metrics_provider, register_profiler
 except ImportError:
     def keep_alive(): pass
+    def register_metrics_provider(provider): pass
+    def register_profiler(profile, token): pass
 
 # ============================================================================
 # 1. LOGGING & METRICS
@@ -45,31 +60,218 @@ logger = logging.getLogger("NewsRadar-v9.3")
 class TelegramLogHandler(logging.Handler):
     """
     این کلاس لاگ‌های مهم را به کانال تلگرام ارسال می‌کند.
+    رکوردها در یک بافر محدود جمع می‌شوند و run() هر چند ثانیه آن‌ها را در یک پیام
+    (تا سقف ۴۰۹۶ کاراکتر) می‌فرستد. ارسال از همان PublishScheduler محتوا توکن می‌گیرد
+    ولی با اولویت پایین‌تر، پس طوفان لاگ نمی‌تواند سهمیه ارسال اخبار را بسوزاند.
     """
-    def __init__(self, client, chat_id):
+    MAX_MESSAGE_LEN = 4096
+
+    def __init__(self, client, chat_id, scheduler=None, interval: float = 10.0, max_buffer: int = 500):
         super().__init__()
         self.client = client
         self.chat_id = chat_id
+        self.scheduler = scheduler
+        self.interval = interval
+        self.max_buffer = max_buffer
+        self.buffer: deque = deque()
+        self.dropped = 0          # کل رکوردهای دور ریخته شده (سرریز بافر)
+        self._dropped_unreported = 0
+        self.sent_messages = 0
 
     def emit(self, record):
         # جلوگیری از ارسال لاگ‌های خود کتابخانه Telethon (برای جلوگیری از لوپ)
         if "telethon" in record.name.lower(): return
         
         try:
+            if len(self.buffer) >= self.max_buffer:
+                self.dropped += 1
+                self._dropped_unreported += 1
+                return
             msg = self.format(record)
-            # ارسال پیام به صورت Task جداگانه تا سرعت برنامه اصلی گرفته نشود
-            if self.client.is_connected():
-                asyncio.create_task(
-                    self.client.send_message(
-                        self.chat_id, 
-                        f"<code>{msg}</code>", 
-                        parse_mode='html'
-                    )
-                )
+            self.buffer.append(f"<code>{msg[:self.MAX_MESSAGE_LEN - 200]}</code>")
         except:
             # اگر خطایی در ارسال لاگ بود، نادیده بگیر تا برنامه متوقف نشود
             pass
 
+    def _next_chunk(self) -> str:
+        """Pops as many buffered records as fit in one Telegram message"""
+        lines = []
+        if self._dropped_unreported:
+            lines.append(f"⚠️ <b>{self._dropped_unreported} log records dropped (buffer full)</b>")
+            self._dropped_unreported = 0
+        size = sum(len(line) + 1 for line in lines)
+        while self.buffer and size + len(self.buffer[0]) + 1 <= self.MAX_MESSAGE_LEN:
+            line = self.buffer.popleft()
+            lines.append(line)
+            size += len(line) + 1
+        return "\n".join(lines)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            # At most one message per interval; a backlog waits in the bounded buffer
+            if not (self.buffer or self._dropped_unreported) or not self.client.is_connected(): continue
+            # Content first: skip this round if a send is waiting, tokens are short or a FloodWait is active
+            if self.scheduler and not self.scheduler.try_acquire("log"): continue
+            chunk = self._next_chunk()
+            try:
+                await self.client.send_message(self.chat_id, chunk, parse_mode='html', link_preview=False)
+                self.sent_messages += 1
+            except errors.FloodWaitError as e:
+                if self.scheduler: self.scheduler.on_flood_wait(e.seconds)
+            except Exception:
+                pass
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram (Prometheus layout). observe() is one bisect
+    and three additions, cheap enough to call for every item at every stage.
+    """
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> List[str]:
+        lines, cumulative = [], 0
+        for bound, n in zip(self.BUCKETS + (float('inf'),), self.counts):
+            cumulative += n
+            le = "+Inf" if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+class LoopProfiler:
+    """
+    On-demand sampling profiler for the event loop thread. Nothing runs until
+    profile() is called (from the web server thread). A session samples the loop
+    thread's stack every interval_ms and tags each sample with the running task's
+    stage, which is the _safe_runner name or the coroutine of an unnamed task.
+    A probe coroutine measures loop lag. Results go to out_dir:
+      loop-<time>.folded        collapsed stacks (flamegraph.pl / speedscope)
+      loop-<time>.events.jsonl  slow callbacks and lag spikes >= slow_ms, with stage
+                                and t (seconds into the session)
+    Slow callbacks are seen at sampling resolution: one task holding the loop
+    across consecutive samples.
+    """
+    IDLE = "(idle)"
+
+    def __init__(self, out_dir: str, interval_ms: float, slow_ms: float, max_seconds: float):
+        self.out_dir = out_dir
+        self.interval = max(1.0, interval_ms) / 1000
+        self.slow = slow_ms / 1000
+        self.max_seconds = max_seconds
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread_id: Optional[int] = None
+        self._busy = threading.Lock()
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        """Call from the loop thread"""
+        self.loop = loop
+        self._thread_id = threading.get_ident()
+
+    def _stage(self, task: Optional[asyncio.Task]) -> str:
+        if task is None: return self.IDLE
+        name = task.get_name()
+        if not name.startswith("Task-"): return name
+        coro = task.get_coro()
+        return getattr(coro, '__qualname__', None) or name
+
+    @staticmethod
+    def _collapse(stage: str, frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        names.append(stage)
+        return ";".join(reversed(names))
+
+    async def _probe_lag(self, stop: threading.Event, lags: list, tick: float):
+        loop = asyncio.get_running_loop()
+        while not stop.is_set():
+            started = loop.time()
+            await asyncio.sleep(tick)
+            lag = loop.time() - started - tick
+            if lag >= self.slow: lags.append((time.monotonic(), lag))
+
+    def _sample(self, seconds: float) -> tuple:
+        stacks: Counter = Counter()
+        timeline: List[tuple] = []  # (monotonic, stage)
+        slow: List[Dict[str, Any]] = []
+        run = None  # [task, first_seen, last_seen] of the task holding the loop
+        started = time.monotonic()
+        deadline = started + seconds
+        while True:
+            now = time.monotonic()
+            if now >= deadline: break
+            frame = sys._current_frames().get(self._thread_id)
+            task = asyncio.current_task(self.loop)
+            stage = self._stage(task)
+            if frame is not None: stacks[self._collapse(stage, frame)] += 1
+            timeline.append((now, stage))
+            if run and run[0] is task:
+                run[2] = now
+            else:
+                if run and run[2] - run[1] + self.interval >= self.slow:
+                    slow.append({"event": "slow_callback", "stage": self._stage(run[0]),
+                                 "t": round(run[1] - started, 3), "ms": round((run[2] - run[1] + self.interval) * 1e3, 1)})
+                run = [task, now, now] if task is not None else None
+            time.sleep(self.interval)
+        return stacks, timeline, slow
+
+    def profile(self, seconds: float) -> Dict[str, Any]:
+        """Blocking session of up to max_seconds; returns a summary. One at a time."""
+        if self.loop is None: return {"error": "profiler not attached"}
+        if not self._busy.acquire(blocking=False): return {"error": "a profile is already running"}
+        try:
+            seconds = min(max(1.0, seconds), self.max_seconds)
+            stop, lags = threading.Event(), []
+            probe = asyncio.run_coroutine_threadsafe(self._probe_lag(stop, lags, self.interval), self.loop)
+            stacks, timeline, events = self._sample(seconds)
+            stop.set()
+            try:
+                probe.result(timeout=max(1.0, self.slow * 10))
+            except Exception:
+                probe.cancel()
+
+            times = [t for t, _ in timeline]
+            for woke_at, lag in lags:
+                # Blame whichever stage the sampler saw holding the loop while the probe was late
+                lo, hi = bisect.bisect_left(times, woke_at - lag), bisect.bisect_right(times, woke_at)
+                seen = Counter(stage for _, stage in timeline[lo:hi] if stage != self.IDLE)
+                events.append({"event": "loop_lag", "stage": seen.most_common(1)[0][0] if seen else self.IDLE,
+                               "t": round(woke_at - lag - times[0], 3) if times else 0.0, "ms": round(lag * 1e3, 1)})
+
+            os.makedirs(self.out_dir, exist_ok=True)
+            base = os.path.join(self.out_dir, f"loop-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}")
+            with open(base + ".folded", "w", encoding="utf-8") as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+            with open(base + ".events.jsonl", "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(event, ensure_ascii=False) + "\n" for event in events)
+
+            by_stage = Counter(stage for _, stage in timeline)
+            samples = len(timeline) or 1
+            return {
+                "seconds": seconds, "samples": len(timeline),
+                "busy_share": round(1 - by_stage[self.IDLE] / samples, 4),
+                "stages": {stage: round(n / samples, 4) for stage, n in by_stage.most_common(15)},
+                "slow_callbacks": sum(1 for e in events if e["event"] == "slow_callback"),
+                "loop_lag_events": len(lags),
+                "max_lag_ms": round(max((lag for _, lag in lags), default=0.0) * 1e3, 1),
+                "folded": base + ".folded", "events": base + ".events.jsonl",
+            }
+        finally:
+            self._busy.release()
+
 # ============================================================================
 # 2. CONFIGURATION
 # ============================================================================
@@ -82,15 +284,92 @@ class Config:
     MONGO_URI: str
     
     # تنظیمات صنعتی
-    DB_WORKER_COUNT: int = 3         # تعداد پردازشگرهای موازی دیتابیس
+    DB_WORKER_COUNT: int = 3         # تعداد اولیه پردازشگرهای موازی دیتابیس
+
+    # مقیاس خودکار پردازشگرهای دیتابیس (و اندازه pool اتصال Mongo)
+    DB_WORKERS_MIN: int = 2
+    DB_WORKERS_MAX: int = 16
+    DB_SCALE_INTERVAL: float = 2.0
+    DB_SCALE_UP_DEPTH: int = 300       # صف ورودی بیشتر از این → worker بیشتر
+    DB_SCALE_DOWN_DEPTH: int = 20
+    DB_SCALE_DOWN_TICKS: int = 15      # این تعداد بازه‌ی خلوت پشت سر هم قبل از کم کردن
+    DB_SCALE_HORIZON: float = 10.0     # پیش‌بینی عمق صف با سرعت رشد فعلی (ثانیه)
+    DB_WRITE_LATENCY_MAX: float = 0.25 # بالاتر از این، Mongo گلوگاه است و worker اضافه نمی‌شود
     INGEST_QUEUE_SIZE: int = 2000    # کنترل رم
     PUBLISH_QUEUE_SIZE: int = 1000
     DUPLICATE_TTL: int = 86400 * 3
+    DEDUP_CACHE_SIZE: int = 50000    # هش‌های اخیر در حافظه (جلوگیری از رفت‌وبرگشت Mongo)
+    HISTORY_BATCH_SIZE: int = 100    # حداکثر سند در هر insert_many
+    HISTORY_BATCH_LINGER_MS: int = 5 # مکث برای جمع شدن batch
+
+    # تشخیص خبر تقریباً تکراری (SimHash)
+    NEAR_DUP_ENABLED: bool = True
+    NEAR_DUP_MAX_DISTANCE: int = 6   # حداکثر اختلاف بیت از ۶۴ بیت
+    NEAR_DUP_MIN_TOKENS: int = 8     # متن‌های کوتاه‌تر فقط با هش دقیق بررسی می‌شوند
+    NEAR_DUP_INDEX_SIZE: int = 50000
+
+    # زمان‌بندی ارسال (Token Bucket مشترک)
+    PUBLISH_RATE: float = 1.0        # توکن در ثانیه (نرخ شروع)
+    PUBLISH_RATE_MIN: float = 0.2
+    PUBLISH_RATE_MAX: float = 3.0
+    PUBLISH_BURST: float = 5.0       # ظرفیت سطل
+    PUBLISH_LANE_WEIGHTS: Dict[str, float] = field(default_factory=lambda: {
+        "text": 1.0, "media": 2.0, "heavy": 3.0, "file": 2.0, "album": 4.0, "log": 1.0,
+    })
+
+    # آلبوم کردن فایل‌های کانفیگ
+    MEDIA_BATCH_WINDOW: float = 2.0  # ثانیه انتظار برای جمع شدن فایل‌ها
+    MEDIA_BATCH_MAX: int = 10        # سقف آلبوم تلگرام
+    FORWARD_PROXY_FILES: bool = False  # فوروارد گروهی با کپشن اصلی به‌جای آپلود مجدد
+
+    # پردازش سنگین متن در پروسه‌های جدا (اختیاری)
+    CPU_OFFLOAD: bool = False
+    CPU_WORKERS: int = 2
+    CPU_BATCH_SIZE: int = 32
+
+    # Backfill موازی با checkpoint
+    BACKFILL_CONCURRENCY: int = 4
+    BACKFILL_WINDOW_HOURS: int = 1     # بدون checkpoint: فقط یک ساعت اخیر
+    BACKFILL_MAX_GAP_HOURS: int = 6    # checkpoint قدیمی‌تر از این نادیده گرفته می‌شود
+    BACKFILL_CHECKPOINT_EVERY: int = 50
+    BACKFILL_RETRIES: int = 3          # تلاش مجدد از همان نقطه‌ای که backfill قطع شد
+    CHECKPOINT_FLUSH_INTERVAL: int = 15
+
+    # ژورنال محلی صف‌ها (بازیابی بعد از کرش/ری‌استارت)
+    JOURNAL_ENABLED: bool = True
+    JOURNAL_PATH: str = "newsradar_journal.db"
+    JOURNAL_COMMIT_MS: int = 50        # group commit
+    JOURNAL_FSYNC: bool = True         # synchronous=FULL در هر commit
+    JOURNAL_MAX_ENTRIES: int = 20000
+
+    # صف ورودی اولویت‌دار: با پر شدن صف، اول Discovery و پروکسی کنار گذاشته می‌شوند
+    SPILL_ENABLED: bool = True         # سرریز خبر/پروکسی روی دیسک به‌جای دور ریختن
+    SPILL_PATH: str = "newsradar_spill.db"
+    SPILL_MAX_ENTRIES: int = 50000
+    SPILL_RESUME_RATIO: float = 0.5    # وقتی صف زیر این نسبت برسد، سرریز برمی‌گردد
+    SPILL_DRAIN_INTERVAL: float = 1.0
+
+    # اجرای چند نمونه موازی (هر نمونه با STRING_SESSION جداگانه از همان اکانت)
+    SHARD_ENABLED: bool = False
+    INSTANCE_ID: str = field(default_factory=lambda: f"{socket.gethostname()}-{os.getpid()}")
+    LEASE_TTL: int = 30                 # نمونه‌ای که این مدت heartbeat نزند، منابعش آزاد می‌شود
+    LEASE_HEARTBEAT: int = 10
+    COOLDOWN_SYNC_INTERVAL: float = 2.0 # خواندن FloodWait مشترک از Mongo
     
     # === تنظیمات لاگ تلگرام ===
     # آیدی کانال لاگ خود را اینجا وارد کنید (مثال: -100123456789)
     # اکانت ربات باید در این کانال ادمین باشد
     LOG_CHANNEL_ID: int = -1003821386891  # <--- اینجا را تغییر دهید
+    LOG_FLUSH_INTERVAL: float = 10.0   # هر چند ثانیه یک پیام لاگ (تجمیع شده)
+    LOG_BUFFER_SIZE: int = 500         # بیشتر از این، رکوردها دور ریخته و شمرده می‌شوند
+
+    # پروفایل زنده حلقه‌ی asyncio از طریق /debug/profile?token=...&seconds=...
+    # بدون PROFILE_TOKEN این مسیر غیرفعال است و هزینه‌ای ندارد
+    PROFILE_TOKEN: str = ""
+    PROFILE_DIR: str = "profiles"
+    PROFILE_INTERVAL_MS: float = 5.0
+    PROFILE_SLOW_MS: float = 100.0     # callback یا تأخیر حلقه بیشتر از این ثبت می‌شود
+    PROFILE_MAX_SECONDS: float = 120.0
     
     # ⚠️ مهم: شناسه (ID) عددی کانال‌های خود را اینجا وارد کنید
     NEWS_SOURCES: Dict[int, str] = field(default_factory=lambda: {
@@ -105,6 +384,15 @@ class Config:
     })
     
     PROXY_FILE_EXTENSIONS: tuple = ('.npvt', '.pv', '.conf', '.ovpn')
+
+    # رجیستری چت‌های ناشناس (Discovery) - LRU در حافظه + ذخیره دسته‌ای در Mongo
+    DISCOVERY_CACHE_SIZE: int = 10000
+    DISCOVERY_TTL: int = 86400          # چت بی‌فعالیت بیشتر از این از حافظه حذف می‌شود
+    DISCOVERY_FLUSH_INTERVAL: int = 30
+
+    # ویرایش پست‌ها: فقط تغییرات واقعی (متن/رسانه/کانفیگ جدید) وارد پایپ‌لاین می‌شوند
+    EDIT_CACHE_SIZE: int = 20000
+    EDIT_CACHE_TTL: int = 48 * 3600
     
     BLACKLIST: tuple = (
         "@deutsch_news1", "deutsch_news1", 
@@ -120,6 +408,13 @@ class Config:
     SIG_NEWS = "\n\n📡 <b>رادار اخبار</b>\n🆔 @NewsRadar_hub"
     SIG_PROXY = "\n\n🔐 <b>کانفیگ اختصاصی</b>\n🆔 @NewsRadar_hub"
 
+    def routing_table(self) -> Dict[int, tuple]:
+        """chat_id -> (payload type, source name, is_news). Proxy wins for chats listed in both"""
+        routes = {chat_id: ('raw_news', name, True) for chat_id, name in self.NEWS_SOURCES.items()}
+        for chat_id, name in self.PROXY_SOURCES.items():
+            routes[chat_id] = ('raw_proxy', name or self.NEWS_SOURCES.get(chat_id), chat_id in self.NEWS_SOURCES)
+        return routes
+
     @classmethod
     def from_env(cls):
         target = os.getenv("TARGET_CHANNEL", "")
@@ -131,12 +426,40 @@ class Config:
         try: log_channel = int(log_channel)
         except: log_channel = None # اگر ست نشده بود، نادیده بگیر
 
+        # برای بازیابی ژورنال بعد از ری‌استارت، INSTANCE_ID ثابت تعیین کنید
+        shard = os.getenv("SHARD_ENABLED", "0") in ("1", "true", "True")
+        instance_id = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
         return cls(
             API_ID=int(os.getenv("TELEGRAM_API_ID", "0")),
             API_HASH=os.getenv("TELEGRAM_API_HASH", ""),
             STRING_SESSION=os.getenv("STRING_SESSION", ""),
             TARGET_CHANNEL=target,
             MONGO_URI=os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+            DEDUP_CACHE_SIZE=int(os.getenv("DEDUP_CACHE_SIZE", cls.DEDUP_CACHE_SIZE)),
+            HISTORY_BATCH_SIZE=int(os.getenv("HISTORY_BATCH_SIZE", cls.HISTORY_BATCH_SIZE)),
+            HISTORY_BATCH_LINGER_MS=int(os.getenv("HISTORY_BATCH_LINGER_MS", cls.HISTORY_BATCH_LINGER_MS)),
+            NEAR_DUP_ENABLED=os.getenv("NEAR_DUP_ENABLED", "1") not in ("0", "false", "False"),
+            NEAR_DUP_MAX_DISTANCE=int(os.getenv("NEAR_DUP_MAX_DISTANCE", cls.NEAR_DUP_MAX_DISTANCE)),
+            CPU_OFFLOAD=os.getenv("CPU_OFFLOAD", "0") in ("1", "true", "True"),
+            CPU_WORKERS=int(os.getenv("CPU_WORKERS", cls.CPU_WORKERS)),
+            CPU_BATCH_SIZE=int(os.getenv("CPU_BATCH_SIZE", cls.CPU_BATCH_SIZE)),
+            DB_WORKERS_MIN=int(os.getenv("DB_WORKERS_MIN", cls.DB_WORKERS_MIN)),
+            DB_WORKERS_MAX=int(os.getenv("DB_WORKERS_MAX", cls.DB_WORKERS_MAX)),
+            DB_WRITE_LATENCY_MAX=float(os.getenv("DB_WRITE_LATENCY_MAX", cls.DB_WRITE_LATENCY_MAX)),
+            JOURNAL_ENABLED=os.getenv("JOURNAL_ENABLED", "1") not in ("0", "false", "False"),
+            JOURNAL_PATH=os.getenv("JOURNAL_PATH") or (
+                f"newsradar_journal_{instance_id}.db" if shard else cls.JOURNAL_PATH),
+            SPILL_ENABLED=os.getenv("SPILL_ENABLED", "1") not in ("0", "false", "False"),
+            SPILL_PATH=os.getenv("SPILL_PATH") or (
+                f"newsradar_spill_{instance_id}.db" if shard else cls.SPILL_PATH),
+            SHARD_ENABLED=shard,
+            INSTANCE_ID=instance_id,
+            LEASE_TTL=int(os.getenv("LEASE_TTL", cls.LEASE_TTL)),
+            LEASE_HEARTBEAT=int(os.getenv("LEASE_HEARTBEAT", cls.LEASE_HEARTBEAT)),
+            PROFILE_TOKEN=os.getenv("PROFILE_TOKEN", ""),
+            PROFILE_DIR=os.getenv("PROFILE_DIR", cls.PROFILE_DIR),
+            PROFILE_SLOW_MS=float(os.getenv("PROFILE_SLOW_MS", cls.PROFILE_SLOW_MS)),
             LOG_CHANNEL_ID=log_channel if log_channel else cls.LOG_CHANNEL_ID
         )
 
@@ -144,10 +467,14 @@ class Config:
 # 3. CONTENT ENGINE
 # ============================================================================
 class ContentEngine:
-# 🟢 جایگزین کن:
     PROTOCOL_PATTERN = re.compile(r'(?:vmess|vless|trojan|ss|tuic|hysteria2?|http|https)://[^\s<>"\)\]]+', re.IGNORECASE)
     MTPROTO_PATTERN = re.compile(r'https://t\.me/proxy\?[^\s<>"\)\]]+', re.IGNORECASE)
     MENTION_CLEANER = re.compile(r'@[a-zA-Z0-9_]+')
+    WORD_PATTERN = re.compile(r'\w+')
+    SOCIAL_HOSTS = frozenset({'t.me', 'instagram.com', 'youtube.com', 'twitter.com', 'x.com'})
+    NEWLINE_RUNS = re.compile(r'\n{3,}')
+    VMESS_DROP_KEYS = frozenset({'ps', 'remark', 'remarks'})
+    PROXY_HASH_CACHE_SIZE = 16384
 
     @staticmethod
     def sanitize_text(text: str) -> str:
@@ -160,37 +487,101 @@ class ContentEngine:
         normalized = re.sub(r'\s+', '', text.lower().strip())
         return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
 
-# 🟢 جایگزین کن:
+    @classmethod
+    def _is_social_link(cls, uri: str) -> bool:
+        """True for http(s) links whose host (or a parent domain) is a known social site"""
+        authority = uri.split('://', 1)[1]
+        for sep in '/?#':
+            authority = authority.split(sep, 1)[0]
+        host = authority.rpartition('@')[2].split(':', 1)[0].lower().rstrip('.')
+        while host:
+            if host in cls.SOCIAL_HOSTS: return True
+            host = host.partition('.')[2]
+        return False
+
+    @staticmethod
+    def _b64decode(data: str) -> Optional[bytes]:
+        """Standard or URL-safe base64, padding optional; None if it isn't base64"""
+        data = unquote(data).strip()
+        try:
+            return base64.b64decode(data.replace('-', '+').replace('_', '/') + '=' * (-len(data) % 4), validate=True)
+        except (binascii.Error, ValueError):
+            return None
+
+    @classmethod
+    def canonical_proxy(cls, uri: str) -> str:
+        """
+        One spelling per config, so reposts hash alike: the #remark is dropped, query
+        params sorted, percent-escapes decoded, the host lowercased, vmess JSON decoded
+        (without its "ps" remark) and ss userinfo base64-decoded. Parts that don't
+        parse are kept as written.
+        """
+        scheme, _, rest = uri.partition('://')
+        scheme = scheme.lower()
+        rest = rest.split('#', 1)[0]
+
+        if scheme == 'vmess':
+            raw = cls._b64decode(rest)
+            try:
+                cfg = json.loads(raw) if raw else None
+            except ValueError:
+                cfg = None
+            if isinstance(cfg, dict):
+                # Clients write port/aid as numbers or strings and omit empty fields
+                cfg = {k: str(v).strip() for k, v in cfg.items() if k not in cls.VMESS_DROP_KEYS and v not in ('', None)}
+                if 'add' in cfg: cfg['add'] = cfg['add'].lower()
+                return 'vmess://' + json.dumps(cfg, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+        rest, _, query = rest.partition('?')
+        authority, slash, path = rest.partition('/')
+        userinfo, at, hostport = authority.rpartition('@')
+        if scheme == 'ss':
+            if not at:
+                # Legacy form: the whole method:password@host:port is base64
+                raw = cls._b64decode(authority)
+                if raw and b'@' in raw:
+                    userinfo, at, hostport = raw.decode('utf-8', 'replace').rpartition('@')
+            elif ':' not in userinfo:
+                raw = cls._b64decode(userinfo)
+                if raw: userinfo = raw.decode('utf-8', 'replace')
+        params = sorted(parse_qsl(query, keep_blank_values=True))
+        canonical = f"{scheme}://{unquote(userinfo)}{at}{hostport.lower()}"
+        if path.strip('/'): canonical += slash + unquote(path)
+        if params: canonical += '?' + urlencode(params, quote_via=quote)
+        return canonical
+
+    @classmethod
+    @functools.lru_cache(maxsize=PROXY_HASH_CACHE_SIZE)
+    def proxy_hash(cls, uri: str) -> str:
+        """Content hash of the canonical form, memoized: dumps repost the same strings constantly"""
+        return cls.get_content_hash(cls.canonical_proxy(uri))
+
     @classmethod
     def extract_proxies(cls, raw_text: str) -> list:
+        """One scan; unique URIs in order of first appearance"""
         if not raw_text: return []
-        sanitized_text = cls.sanitize_text(raw_text)
-        results = []
-        results.extend(cls.PROTOCOL_PATTERN.findall(raw_text))
-        results.extend(cls.MTPROTO_PATTERN.findall(raw_text))
-        results.extend(cls.PROTOCOL_PATTERN.findall(sanitized_text))
-        
-        # فیلتر کردن لینک‌های مزاحم
-        cleaned_results = []
-        for p in results:
-            p = p.strip(").], ")
-            if len(p) < 10: continue
+        # ZWNJ inside a pasted config breaks it; the old sanitized pass existed for that
+        text = raw_text.replace('\u200c', '')
+        seen = {}
+        for m in cls.PROTOCOL_PATTERN.finditer(text):
+            p = m.group().strip(").], ")
+            if len(p) < 10 or p in seen: continue
             # اگر http است اما مربوط به تلگرام/اینستاگرام/توییتر است، کانفیگ نیست
-            if p.lower().startswith('http'):
-                if any(x in p.lower() for x in ['t.me', 'instagram.com', 'youtube.com', 'twitter.com', 'x.com']):
-                    continue
-            cleaned_results.append(p)
-            
-        return list(set(cleaned_results))
+            if p[:4].lower() == 'http' and cls._is_social_link(p): continue
+            seen[p] = None
+        return list(seen)
 
     @classmethod
     def clean_news(cls, text: str, blacklist: tuple) -> str:
         if not text: return None
+        # Ordered str scans on purpose: `in` is a C fastsearch, and a single alternation
+        # regex needs extra guards to reproduce replace-order effects ('pvpn', 'p@v')
         for bad in blacklist:
             if bad in text: text = text.replace(bad, "")
-        text = cls.MENTION_CLEANER.sub('', text)
-        text = re.sub(r'\n{3,}', '\n\n', text).strip()
-        if not text or len(text.strip()) == 0: return None
+        if '@' in text: text = cls.MENTION_CLEANER.sub('', text)
+        if '\n\n\n' in text: text = cls.NEWLINE_RUNS.sub('\n\n', text)
+        text = text.strip()
+        if not text: return None
         return text
 
     @staticmethod
@@ -201,75 +592,1376 @@ class ContentEngine:
         if any(x in t for x in ['جنگ', 'حمله', 'war']): return '⚔️'
         return '📰'
 
+    @classmethod
+    def simhash(cls, text: str, min_tokens: int = 1) -> Optional[int]:
+        """64-bit SimHash over word counts; emoji and punctuation don't count. None if too short"""
+        tokens = cls.WORD_PATTERN.findall(text.replace('\u200c', '').lower())
+        if len(tokens) < min_tokens: return None
+        weights = [0] * 64
+        for token, count in Counter(tokens).items():
+            h = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big')
+            for bit in range(64):
+                weights[bit] += count if (h >> bit) & 1 else -count
+        return sum(1 << bit for bit, w in enumerate(weights) if w > 0)
+
+    @classmethod
+    def analyze(cls, kind: str, text: str, blacklist: tuple, near_dup_min_tokens: Optional[int] = None):
+        """
+        The pure CPU part of the DB stage (no I/O, picklable in/out):
+        raw_proxy -> [(config, hash), ...]; raw_news -> (clean, hash, simhash) or None.
+        """
+        if kind == 'raw_proxy':
+            # Spellings of one config in the same post collapse to the first one
+            found = {}
+            for conf in cls.extract_proxies(text):
+                found.setdefault(cls.proxy_hash(conf), conf)
+            return [(conf, h) for h, conf in found.items()]
+        clean = cls.clean_news(text, blacklist)
+        if not clean: return None
+        fp = cls.simhash(clean, near_dup_min_tokens) if near_dup_min_tokens is not None else None
+        return (clean, cls.get_content_hash(clean), fp)
+
+
+def analyze_batch(jobs: List[tuple], blacklist: tuple, near_dup_min_tokens: Optional[int]) -> list:
+    """Process-pool entry point: ContentEngine.analyze over (kind, text) jobs"""
+    return [ContentEngine.analyze(kind, text, blacklist, near_dup_min_tokens) for kind, text in jobs]
+
+
+class SimHashIndex:
+    """
+    Banded LSH over 64-bit SimHash fingerprints. With max_distance + 1 bands, any
+    fingerprint within max_distance bits shares at least one whole band (pigeonhole),
+    so a lookup only compares against that band's bucket, not the whole window.
+    """
+    def __init__(self, max_distance: int, ttl: int, max_size: int):
+        self.max_distance = max(0, min(max_distance, 31))
+        n_bands = self.max_distance + 1
+        width = 64 // n_bands
+        self._bands = []
+        for i in range(n_bands):
+            bits = 64 - i * width if i == n_bands - 1 else width
+            self._bands.append((i * width, (1 << bits) - 1))
+        self._buckets: List[Dict[int, Set[int]]] = [{} for _ in self._bands]
+        self._expires: Dict[int, float] = {}
+        self._order: deque = deque()  # (expires_at, fingerprint), oldest first
+        self.ttl = ttl
+        self.max_size = max_size
+
+    def __len__(self):
+        return len(self._expires)
+
+    def find(self, fp: int) -> Optional[int]:
+        """Returns a stored fingerprint within max_distance bits, if any"""
+        self._evict()
+        for (shift, mask), buckets in zip(self._bands, self._buckets):
+            for other in buckets.get((fp >> shift) & mask, ()):
+                if (fp ^ other).bit_count() <= self.max_distance: return other
+        return None
+
+    def add(self, fp: int, seen_at: Optional[float] = None):
+        expires = (seen_at or time.time()) + self.ttl
+        if fp not in self._expires:
+            for (shift, mask), buckets in zip(self._bands, self._buckets):
+                buckets.setdefault((fp >> shift) & mask, set()).add(fp)
+        self._expires[fp] = expires
+        self._order.append((expires, fp))
+        self._evict()
+
+    def _evict(self):
+        now = time.time()
+        while self._order:
+            expires, fp = self._order[0]
+            if expires >= now and len(self._expires) <= self.max_size: break
+            self._order.popleft()
+            # Stale queue entry: the fingerprint was re-added later with a new expiry
+            if self._expires.get(fp) != expires: continue
+            del self._expires[fp]
+            for (shift, mask), buckets in zip(self._bands, self._buckets):
+                key = (fp >> shift) & mask
+                bucket = buckets.get(key)
+                if bucket is None: continue
+                bucket.discard(fp)
+                if not bucket: del buckets[key]
+
 # ============================================================================
 # 4. DATABASE
 # ============================================================================
+class RecentHashCache:
+    """Bounded LRU of recently seen history keys, expiring with DUPLICATE_TTL"""
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[bytes, float]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def contains(self, key: bytes) -> bool:
+        expires = self._entries.get(key)
+        if expires is None:
+            self.misses += 1
+            return False
+        if expires < time.time():
+            del self._entries[key]
+            self.misses += 1
+            return False
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True
+
+    def peek(self, key: bytes) -> bool:
+        """contains() without touching the LRU order or the hit/miss counters"""
+        expires = self._entries.get(key)
+        return expires is not None and expires >= time.time()
+
+    def add(self, key: bytes, seen_at: Optional[float] = None, ttl: Optional[float] = None):
+        if self.max_size <= 0: return
+        self._entries[key] = (seen_at or time.time()) + (self.ttl if ttl is None else ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+class MicroBatcher:
+    """Collects submissions for a few ms (or up to max_batch) and hands them to _flush together"""
+    def __init__(self, max_batch: int, linger_ms: int):
+        self.max_batch = max(1, max_batch)
+        self.linger = max(0, linger_ms) / 1000
+        self._pending: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._inflight: Set[asyncio.Task] = set()
+        self.flushes = 0
+
+    async def submit(self, job):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((job, fut))
+        if len(self._pending) >= self.max_batch:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.linger, self._start_flush)
+        return await fut
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending: return
+        batch, self._pending = self._pending, []
+        self.flushes += 1
+        task = asyncio.create_task(self._flush(batch))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _flush(self, batch: List[tuple]):
+        """Must resolve every future in batch"""
+        raise NotImplementedError
+
+
+class HistoryBatchWriter(MicroBatcher):
+    """Coalesces inserts from all DB workers into unordered insert_many calls"""
+    DUPLICATE_KEY_CODE = 11000
+
+    def __init__(self, collection, max_batch: int, linger_ms: int):
+        super().__init__(max_batch, linger_ms)
+        self.collection = collection
+        self.docs_written = 0
+
+    async def submit(self, doc: Dict[str, Any]) -> bool:
+        """Resolves True if the document was inserted, False on duplicate key"""
+        return await super().submit(doc)
+
+    async def _flush(self, batch: List[tuple]):
+        docs = [doc for doc, _ in batch]
+        failed: Dict[int, Exception] = {}
+        try:
+            await self.collection.insert_many(docs, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            for err in e.details.get("writeErrors", []):
+                if err.get("code") == self.DUPLICATE_KEY_CODE:
+                    failed[err["index"]] = None
+                else:
+                    failed[err["index"]] = pymongo.errors.WriteError(err.get("errmsg"), err.get("code"), err)
+        except Exception as e:
+            failed = {i: e for i in range(len(batch))}
+
+        self.docs_written += len(batch) - len(failed)
+        for i, (_, fut) in enumerate(batch):
+            if fut.done(): continue
+            if i not in failed:
+                fut.set_result(True)
+            elif failed[i] is None:
+                fut.set_result(False)
+            else:
+                fut.set_exception(failed[i])
+
+
 class Database:
-    def __init__(self, uri: str):
-        self.client = motor.motor_asyncio.AsyncIOMotorClient(uri)
+    """
+    history_v2 documents are kept small for the working set:
+        {_id: 16-byte digest, s: source id, t: created_at, f: simhash (news only)}
+    _id is the dedup key, so the only secondary index is the TTL on t. Source names
+    map to small ints through the sources collection. The hex-keyed history
+    collection of older versions is copied over in the background (migrate_history).
+    """
+    MIGRATION_BATCH = 1000
+    POOL_HEADROOM = 4          # flushers, leases, migration next to the DB workers
+    POOL_IDLE_MS = 60000       # connections of retired workers are closed after this
+    DUPLICATE_RECHECK = 60     # s a duplicate stays cached; Mongo's TTL monitor lags about as much
+    INSTANCE_EXPIRY = 3600     # s until a stopped instance's heartbeat document is dropped
+
+    def __init__(self, uri: str, cache_size: int = Config.DEDUP_CACHE_SIZE,
+                 batch_size: int = Config.HISTORY_BATCH_SIZE,
+                 batch_linger_ms: int = Config.HISTORY_BATCH_LINGER_MS,
+                 workers_min: int = Config.DB_WORKERS_MIN, workers_max: int = Config.DB_WORKERS_MAX):
+        # A DB worker has at most one Mongo operation in flight (its batch), so the
+        # pool is bounded by the worker range and shrinks back as idle sockets age out
+        self.client = motor.motor_asyncio.AsyncIOMotorClient(
+            uri, minPoolSize=workers_min, maxPoolSize=workers_max + self.POOL_HEADROOM,
+            maxIdleTimeMS=self.POOL_IDLE_MS)
         self.db = self.client.newsradar_v9
-        self.history = self.db.history
+        self.history = self.db.history_v2
+        self.legacy_history = None  # set while the old collection still has to be migrated
+        self.raw_proxy_hashes_until = 0.0  # see initialize()
+        self.sources = self.db.sources
+        self._source_ids: Dict[str, int] = {}
+        self.checkpoints = self.db.backfill_checkpoints
+        self.discoveries = self.db.discovered_chats
+        self.leases = self.db.source_leases
+        self.instances = self.db.instances
+        self.cluster_state = self.db.cluster_state
+        self.seen_cache = RecentHashCache(cache_size, Config.DUPLICATE_TTL)
+        self.writer = HistoryBatchWriter(self.history, batch_size, batch_linger_ms)
 
     async def initialize(self):
-        await self.history.create_index("created_at", expireAfterSeconds=Config.DUPLICATE_TTL)
-        await self.history.create_index("content_hash", unique=True)
+        await self.history.create_index("t", expireAfterSeconds=Config.DUPLICATE_TTL)
+        async for doc in self.sources.find():
+            self._source_ids[doc["_id"]] = doc["n"]
+        if "history" in await self.db.list_collection_names():
+            self.legacy_history = self.db.history
+        # Proxies were hashed by their raw URI before they were hashed by canonical form;
+        # those keys keep deduping (seen()) until the TTL has expired them all
+        state = await self.cluster_state.find_one_and_update(
+            {"_id": "proxy_canonical"}, {"$setOnInsert": {"since": datetime.now(timezone.utc)}},
+            upsert=True, return_document=pymongo.ReturnDocument.AFTER)
+        since = state["since"]
+        if since.tzinfo is None: since = since.replace(tzinfo=timezone.utc)
+        self.raw_proxy_hashes_until = since.timestamp() + Config.DUPLICATE_TTL
+        # INSTANCE_ID defaults to hostname-pid, so every restart leaves a heartbeat behind
+        await self.instances.create_index("heartbeat_at", expireAfterSeconds=self.INSTANCE_EXPIRY)
+        await self.discoveries.create_index([("messages", pymongo.DESCENDING)])
+        await self.discoveries.create_index([("last_seen", pymongo.DESCENDING)])
+        await self.warm_cache()
+
+    async def get_checkpoint(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        """{'last_id', 'updated_at'} of the newest message ingested from chat_id"""
+        doc = await self.checkpoints.find_one({"_id": chat_id})
+        if doc and doc["updated_at"].tzinfo is None:
+            doc["updated_at"] = doc["updated_at"].replace(tzinfo=timezone.utc)
+        return doc
+
+    async def save_checkpoints(self, positions: Dict[int, int]):
+        if not positions: return
+        now = datetime.now(timezone.utc)
+        await self.checkpoints.bulk_write([
+            pymongo.UpdateOne({"_id": chat_id}, {"$max": {"last_id": msg_id}, "$set": {"updated_at": now}}, upsert=True)
+            for chat_id, msg_id in positions.items()
+        ], ordered=False)
+
+    async def discovery_known(self, chat_id: int) -> bool:
+        return await self.discoveries.find_one({"_id": chat_id}, {"_id": 1}) is not None
+
+    async def save_discoveries(self, updates: List[tuple]):
+        """Upserts (chat_id, title, first_seen, last_seen, new_messages) from DiscoveryRegistry.drain()"""
+        if not updates: return
+        ops = []
+        for chat_id, title, first_seen, last_seen, new_messages in updates:
+            fields = {"last_seen": datetime.fromtimestamp(last_seen, timezone.utc)}
+            if title: fields["title"] = title
+            ops.append(pymongo.UpdateOne({"_id": chat_id}, {
+                "$set": fields,
+                "$min": {"first_seen": datetime.fromtimestamp(first_seen, timezone.utc)},
+                "$inc": {"messages": new_messages},
+            }, upsert=True))
+        await self.discoveries.bulk_write(ops, ordered=False)
+
+    async def load_discoveries(self, limit: int, ttl: int) -> List[tuple]:
+        """(chat_id, title, first_seen_ts, last_seen_ts) of chats active within ttl, oldest first"""
+        since = datetime.now(timezone.utc) - timedelta(seconds=ttl)
+        cursor = self.discoveries.find({"last_seen": {"$gte": since}}).sort("last_seen", pymongo.DESCENDING).limit(limit)
+        rows = await cursor.to_list(length=limit)
+        result = []
+        for row in reversed(rows):
+            first_seen, last_seen = row["first_seen"], row["last_seen"]
+            if first_seen.tzinfo is None: first_seen = first_seen.replace(tzinfo=timezone.utc)
+            if last_seen.tzinfo is None: last_seen = last_seen.replace(tzinfo=timezone.utc)
+            result.append((row["_id"], row.get("title"), first_seen.timestamp(), last_seen.timestamp()))
+        return result
+
+    # --- Multi-instance coordination ---
+    async def heartbeat(self, instance_id: str, ttl: int) -> int:
+        """Refreshes this instance's heartbeat and returns how many instances are alive"""
+        now = datetime.now(timezone.utc)
+        await self.instances.update_one({"_id": instance_id}, {"$set": {"heartbeat_at": now}}, upsert=True)
+        return await self.instances.count_documents({"heartbeat_at": {"$gte": now - timedelta(seconds=ttl)}})
 
-    async def save_if_new(self, content_hash: str, source: str) -> bool:
+    async def remove_instance(self, instance_id: str):
+        await self.instances.delete_one({"_id": instance_id})
+
+    async def claim_lease(self, key: int, owner: str, ttl: int) -> bool:
+        """Takes a free, expired or already-owned lease; False if another live owner holds it"""
+        now = datetime.now(timezone.utc)
         try:
-            await self.history.insert_one({
-                "content_hash": content_hash,
-                "source": source,
-                "created_at": datetime.now(timezone.utc)
-            })
+            await self.leases.update_one(
+                {"_id": key, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl)}},
+                upsert=True
+            )
             return True
         except pymongo.errors.DuplicateKeyError:
+            # No match and the upsert collided with the live owner's document
+            return False
+
+    async def renew_leases(self, keys: List[int], owner: str, ttl: int) -> Set[int]:
+        """Extends the given leases and returns the subset this owner still holds"""
+        now = datetime.now(timezone.utc)
+        await self.leases.update_many({"_id": {"$in": keys}, "owner": owner},
+                                      {"$set": {"expires_at": now + timedelta(seconds=ttl)}})
+        held = await self.leases.find({"_id": {"$in": keys}, "owner": owner}, {"_id": 1}).to_list(length=None)
+        return {doc["_id"] for doc in held}
+
+    async def release_lease(self, key: int, owner: str):
+        await self.leases.delete_one({"_id": key, "owner": owner})
+
+    async def share_cooldown(self, until: float):
+        await self.cluster_state.update_one({"_id": "floodwait"}, {"$max": {"cooldown_until": until}}, upsert=True)
+
+    async def get_cooldown(self) -> float:
+        doc = await self.cluster_state.find_one({"_id": "floodwait"})
+        return doc.get("cooldown_until", 0.0) if doc else 0.0
+
+    @staticmethod
+    def history_key(content_hash: str) -> bytes:
+        """16-byte _id: the leading half of the SHA-256 digest (non-hex markers like "empty" are hashed)"""
+        try:
+            return bytes.fromhex(content_hash[:32])
+        except ValueError:
+            return hashlib.sha256(content_hash.encode('utf-8')).digest()[:16]
+
+    async def source_id(self, name: Optional[str]) -> int:
+        """Small integer standing in for a source name in history documents"""
+        name = name or "unknown"
+        sid = self._source_ids.get(name)
+        if sid is not None: return sid
+        seq = await self.cluster_state.find_one_and_update(
+            {"_id": "source_seq"}, {"$inc": {"n": 1}}, upsert=True, return_document=pymongo.ReturnDocument.AFTER)
+        try:
+            doc = await self.sources.find_one_and_update(
+                {"_id": name}, {"$setOnInsert": {"n": seq["n"]}}, upsert=True,
+                return_document=pymongo.ReturnDocument.AFTER)
+        except pymongo.errors.DuplicateKeyError:
+            # Another instance registered the same name first
+            doc = await self.sources.find_one({"_id": name})
+        self._source_ids[name] = doc["n"]
+        return doc["n"]
+
+    async def migrate_history(self):
+        """
+        Online copy of the legacy hex-keyed collection into history_v2, in _id order
+        and resumable from the position kept in cluster_state. Runs next to live
+        traffic (save_if_new also consults the legacy collection until it's done),
+        then drops the legacy collection and its indexes.
+        """
+        if self.legacy_history is None: return
+        state = await self.cluster_state.find_one({"_id": "history_migration"}) or {}
+        last_id = state.get("last_id")
+        since = datetime.now(timezone.utc) - timedelta(seconds=Config.DUPLICATE_TTL)
+        copied = 0
+        while True:
+            query = {"created_at": {"$gte": since}}
+            if last_id is not None: query["_id"] = {"$gt": last_id}
+            rows = await self.legacy_history.find(query).sort("_id", pymongo.ASCENDING) \
+                .limit(self.MIGRATION_BATCH).to_list(length=self.MIGRATION_BATCH)
+            if not rows: break
+            docs = []
+            for row in rows:
+                doc = {"_id": self.history_key(row["content_hash"]), "s": await self.source_id(row.get("source")),
+                       "t": row["created_at"]}
+                if "simhash" in row: doc["f"] = row["simhash"]
+                docs.append(doc)
+            try:
+                await self.history.insert_many(docs, ordered=False)
+            except pymongo.errors.BulkWriteError as e:
+                # Already copied, or written live since: both fine
+                if any(err.get("code") != HistoryBatchWriter.DUPLICATE_KEY_CODE for err in e.details.get("writeErrors", [])):
+                    raise
+            last_id = rows[-1]["_id"]
+            copied += len(rows)
+            await self.cluster_state.update_one({"_id": "history_migration"}, {"$set": {"last_id": last_id}}, upsert=True)
+
+        await self.legacy_history.drop()
+        await self.cluster_state.delete_one({"_id": "history_migration"})
+        self.legacy_history = None
+        logger.info(f"🗜️ History migration done: {copied} documents copied, legacy collection dropped")
+
+    async def warm_cache(self):
+        """Preload the newest hashes still inside the TTL window"""
+        if self.seen_cache.max_size <= 0: return
+        since = datetime.now(timezone.utc) - timedelta(seconds=Config.DUPLICATE_TTL)
+        cursor = self.history.find(
+            {"t": {"$gte": since}}, {"t": 1}
+        ).sort("t", pymongo.DESCENDING).limit(self.seen_cache.max_size)
+        rows = await cursor.to_list(length=self.seen_cache.max_size)
+        # Oldest first so the newest end up at the MRU end of the LRU
+        for row in reversed(rows):
+            created = row["t"]
+            if created.tzinfo is None: created = created.replace(tzinfo=timezone.utc)
+            self.seen_cache.add(row["_id"], created.timestamp())
+        logger.info(f"🧠 Dedup cache warmed with {len(self.seen_cache)} hashes")
+
+    async def load_fingerprints(self, limit: int) -> List[tuple]:
+        """(simhash, created_ts) of news still inside the TTL window, oldest first"""
+        since = datetime.now(timezone.utc) - timedelta(seconds=Config.DUPLICATE_TTL)
+        cursor = self.history.find(
+            {"t": {"$gte": since}, "f": {"$exists": True}}, {"f": 1, "t": 1, "_id": 0}
+        ).sort("t", pymongo.DESCENDING).limit(limit)
+        rows = await cursor.to_list(length=limit)
+        result = []
+        for row in reversed(rows):
+            created = row["t"]
+            if created.tzinfo is None: created = created.replace(tzinfo=timezone.utc)
+            result.append((row["f"] & 0xFFFFFFFFFFFFFFFF, created.timestamp()))
+        return result
+
+    async def save_if_new(self, content_hash: str, source: str, simhash: Optional[int] = None) -> bool:
+        key = self.history_key(content_hash)
+        # Fast path: obvious repost, no Mongo round-trip
+        if self.seen_cache.contains(key): return False
+        doc = {"_id": key, "s": await self.source_id(source), "t": datetime.now(timezone.utc)}
+        # Stored as signed int64 (BSON has no unsigned 64-bit type)
+        if simhash is not None: doc["f"] = simhash - (1 << 64) if simhash >= (1 << 63) else simhash
+        is_new = await self.writer.submit(doc)
+        # Cached for as long as Mongo keeps the key: a fresh insert expires TTL from now, but a
+        # duplicate's document expires at its own t + TTL, which isn't known here
+        self.seen_cache.add(key, ttl=None if is_new else self.DUPLICATE_RECHECK)
+        if is_new and self.legacy_history is not None:
+            # Not migrated yet: the hash may only exist in the old collection
+            is_new = await self.legacy_history.find_one({"content_hash": content_hash}, {"_id": 1}) is None
+        return is_new
+
+    async def seen(self, content_hash: str) -> bool:
+        """Lookup only: True if content_hash is still inside the TTL window. Writes nothing"""
+        key = self.history_key(content_hash)
+        if self.seen_cache.peek(key): return True
+        if await self.history.find_one({"_id": key}, {"_id": 1}) is not None: return True
+        if self.legacy_history is None: return False
+        return await self.legacy_history.find_one({"content_hash": content_hash}, {"_id": 1}) is not None
+
+class IngestJournal:
+    """
+    Local SQLite (WAL) journal of the items sitting in the pipeline queues. An entry is
+    appended when an item enters a stage and acked when it leaves; whatever is still
+    there at startup gets replayed. Appends/acks are group-committed every commit_ms
+    on a dedicated thread, so the event loop never waits on fsync.
+    """
+    COMPACT_EVERY = 600  # commits (~30s at 50ms)
+
+    def __init__(self, path: str, commit_ms: int, fsync: bool, max_entries: int):
+        self.path = path
+        self.commit_interval = max(1, commit_ms) / 1000
+        self.fsync = fsync
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._appends: List[tuple] = []
+        self._acks: List[int] = []
+        self._next_id = 1
+        self._commits = 0
+        self.size = 0
+        self.dropped = 0
+
+    async def open(self) -> List[tuple]:
+        """Opens (or creates) the journal and returns unacked (id, stage, record) entries"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._open_sync)
+
+    def _open_sync(self) -> List[tuple]:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={'FULL' if self.fsync else 'NORMAL'}")
+        conn.execute("CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY, stage TEXT NOT NULL, body TEXT NOT NULL)")
+        rows = conn.execute("SELECT id, stage, body FROM entries ORDER BY id").fetchall()
+        self._conn = conn
+        self._next_id = rows[-1][0] + 1 if rows else 1
+        self.size = len(rows)
+        return [(entry_id, stage, json.loads(body)) for entry_id, stage, body in rows]
+
+    def append(self, stage: str, record: Dict[str, Any]) -> int:
+        entry_id = self._next_id
+        self._next_id += 1
+        self._appends.append((entry_id, stage, json.dumps(record, ensure_ascii=False)))
+        return entry_id
+
+    def ack(self, entry_id: Optional[int]):
+        if entry_id is not None: self._acks.append(entry_id)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.commit_interval)
+            await self.commit()
+
+    async def commit(self):
+        if not self._appends and not self._acks: return
+        appends, acks = self._appends, self._acks
+        self._appends, self._acks = [], []
+        # Items that entered and left within one interval never need to touch disk
+        batch_ids = {a[0] for a in appends}
+        acked = set(acks)
+        to_insert = [a for a in appends if a[0] not in acked]
+        to_delete = [(i,) for i in acked if i not in batch_ids]
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._commit_sync, to_insert, to_delete)
+        except Exception:
+            self._appends[:0], self._acks[:0] = appends, acks
+            raise
+
+    def _commit_sync(self, appends: List[tuple], acks: List[tuple]):
+        conn = self._conn
+        conn.execute("BEGIN")
+        try:
+            conn.executemany("INSERT INTO entries (id, stage, body) VALUES (?, ?, ?)", appends)
+            deleted = conn.executemany("DELETE FROM entries WHERE id = ?", acks).rowcount if acks else 0
+            self.size += len(appends) - max(deleted, 0)
+            if self.size > self.max_entries:
+                # Over budget: shed the oldest not-yet-processed ingest entries first
+                excess = self.size - self.max_entries
+                cur = conn.execute(
+                    "DELETE FROM entries WHERE id IN (SELECT id FROM entries WHERE stage = 'ingest' ORDER BY id LIMIT ?)",
+                    (excess,)
+                )
+                self.size -= cur.rowcount
+                self.dropped += cur.rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._commits += 1
+        if self._commits % self.COMPACT_EVERY == 0:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("PRAGMA incremental_vacuum")
+
+
+class SpillStore:
+    """
+    Local SQLite overflow for ingest items the full queue could not hold. Items are
+    buffered in memory and written by flush(); take() hands back the best-ranked
+    ones first. Runs on its own thread like IngestJournal.
+    """
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spill")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: List[tuple] = []  # (rank, body, journal_id)
+        self.size = 0
+        self.dropped = 0
+
+    @property
+    def backlog(self) -> int:
+        return self.size + len(self._pending)
+
+    async def open(self):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._open_sync)
+
+    def _open_sync(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS spill (id INTEGER PRIMARY KEY, rank INTEGER NOT NULL, body TEXT NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS spill_rank ON spill (rank, id)")
+        self.size = conn.execute("SELECT COUNT(*) FROM spill").fetchone()[0]
+        self._conn = conn
+
+    def add(self, rank: int, record: Dict[str, Any], journal_id: Optional[int]) -> bool:
+        """False when the store is at capacity and the item has to be dropped"""
+        if self.backlog >= self.max_entries:
+            self.dropped += 1
             return False
+        self._pending.append((rank, json.dumps(record, ensure_ascii=False), journal_id))
+        return True
+
+    async def flush(self) -> List[int]:
+        """Writes buffered items; returns their journal ids, now safe to ack"""
+        if not self._pending: return []
+        pending, self._pending = self._pending, []
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._write_sync, [(rank, body) for rank, body, _ in pending])
+        except Exception:
+            self._pending[:0] = pending
+            raise
+        return [journal_id for _, _, journal_id in pending if journal_id is not None]
+
+    def _write_sync(self, rows: List[tuple]):
+        conn = self._conn
+        conn.execute("BEGIN")
+        try:
+            conn.executemany("INSERT INTO spill (rank, body) VALUES (?, ?)", rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.size += len(rows)
+
+    async def take(self, limit: int) -> List[tuple]:
+        """Removes and returns up to limit (rank, record) pairs, best rank first"""
+        if limit <= 0 or not self.size: return []
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._take_sync, limit)
+
+    def _take_sync(self, limit: int) -> List[tuple]:
+        conn = self._conn
+        conn.execute("BEGIN")
+        try:
+            rows = conn.execute("SELECT id, rank, body FROM spill ORDER BY rank, id LIMIT ?", (limit,)).fetchall()
+            conn.executemany("DELETE FROM spill WHERE id = ?", [(row[0],) for row in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.size -= len(rows)
+        if not self.size: conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return [(rank, json.loads(body)) for _, rank, body in rows]
+
 
 # ============================================================================
 # 5. PIPELINE ARCHITECTURE (The Engine)
 # ============================================================================
+class PayloadRecord:
+    """Journal (de)serialization shared by the slotted queue records below"""
+    __slots__ = ()
+    TRANSIENT = ('media', 'ingested_at', 'queued_at', 'journal_id')
+
+    def to_record(self) -> Dict[str, Any]:
+        """JSON-safe copy; the Telegram message is re-fetched on replay only if it has media"""
+        record = {name: getattr(self, name) for name in self.__slots__ if name not in self.TRANSIENT}
+        record['needs_message'] = self.media is not None
+        return record
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any], journal_id: int, media: Any = None):
+        fields = {k: v for k, v in record.items() if k in cls.__slots__ and k not in cls.TRANSIENT}
+        if 'content' in record: fields.setdefault('text', record['content'])  # pre-record journal entries
+        return cls(**fields, media=media, journal_id=journal_id)
+
+
+@dataclass(slots=True)
+class IngestItem(PayloadRecord):
+    """
+    A source message reduced to what the DB stage and publishers need. The Telethon
+    Message (with its entities and media graph) is not kept past build_payload().
+    """
+    type: str                        # raw_proxy | raw_news | discovery
+    chat_id: int
+    msg_id: Optional[int] = None
+    source: Optional[str] = None     # source name, chat title for discovery
+    text: str = ""
+    media: Any = None                # InputMedia reference, see media_ref()
+    file_name: Optional[str] = None
+    file_size: Optional[int] = None
+    is_heavy: bool = False
+    ingested_at: float = 0.0         # monotonic, 0 for replayed items
+    journal_id: Optional[int] = None
+
+
+@dataclass(slots=True)
+class PublishItem(PayloadRecord):
+    type: str                        # proxy_text | proxy_file | news
+    source: str
+    text: str = ""                   # config URI for proxy_text, cleaned body for news
+    media: Any = None
+    chat_id: Optional[int] = None
+    msg_id: Optional[int] = None
+    is_heavy: bool = False
+    ingested_at: float = 0.0
+    queued_at: float = 0.0
+    journal_id: Optional[int] = None
+
+
+def media_ref(msg) -> Any:
+    """Compact InputMedia to re-send a message's media, None for no media or a link preview"""
+    media = msg.media
+    if media is None or isinstance(media, MessageMediaWebPage): return None
+    try:
+        return utils.get_input_media(media)
+    except TypeError:
+        return media
+
+
+class PriorityIngestQueue(asyncio.Queue):
+    """
+    Bounded ingest queue served best class first (FIFO within a class). A put on a
+    full queue never waits for room here: offer() displaces the newest item of the
+    lowest queued class, or hands back the incoming item if nothing ranks below it.
+    """
+    CLASSES = ("urgent", "news", "proxy", "discovery")
+    URGENT_MARK = '🔴'
+
+    @classmethod
+    def rank(cls, item: IngestItem) -> int:
+        if item.type == 'raw_news': return 0 if ContentEngine.get_emoji(item.text) == cls.URGENT_MARK else 1
+        return 2 if item.type == 'raw_proxy' else 3
+
+    def _init(self, maxsize):
+        self._queue = [deque() for _ in self.CLASSES]
+        self._size = 0
+
+    def qsize(self):
+        return self._size
+
+    def empty(self):
+        return not self._size
+
+    def depths(self) -> List[int]:
+        return [len(q) for q in self._queue]
+
+    def _put(self, item):
+        self._queue[self.rank(item)].append(item)
+        self._size += 1
+
+    def _get(self):
+        self._size -= 1
+        for q in self._queue:
+            if q: return q.popleft()
+
+    def offer(self, item: IngestItem) -> Optional[tuple]:
+        """put_nowait that sheds instead of raising: (rank, item) left out, or None"""
+        if not self.full():
+            self.put_nowait(item)
+            return None
+        rank = self.rank(item)
+        for worst in range(len(self.CLASSES) - 1, rank, -1):
+            if self._queue[worst]:
+                victim = self._queue[worst].pop()
+                self._size -= 1
+                self.put_nowait(item)
+                self.task_done()  # the victim will never be processed
+                return worst, victim
+        return rank, item
+
+
+class ContentOffloader:
+    """
+    Runs ContentEngine.analyze for batches of items in a ProcessPoolExecutor. A DB
+    worker hands over its share of the queued backlog in one call (share()), so
+    batches grow with the backlog rather than with the number of DB workers, and
+    nothing waits on a linger timer.
+    """
+    def __init__(self, workers: int, batch_size: int, blacklist: tuple, near_dup_min_tokens: Optional[int]):
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.max_batch = max(1, batch_size)
+        self.blacklist = blacklist
+        self.near_dup_min_tokens = near_dup_min_tokens
+        self.flushes = 0
+
+    def share(self, queued: int, workers: int) -> int:
+        """Items one worker takes per pull: the one it holds plus its part of what is queued"""
+        return min(self.max_batch, 1 + queued // max(1, workers))
+
+    async def analyze_batch(self, jobs: List[tuple]) -> list:
+        """(kind, text) jobs -> ContentEngine.analyze results, in order"""
+        self.flushes += 1
+        return await asyncio.get_running_loop().run_in_executor(
+            self.pool, analyze_batch, jobs, self.blacklist, self.near_dup_min_tokens
+        )
+
+
+class PublishScheduler:
+    """
+    Shared token bucket for every send. Lanes cost different amounts of tokens
+    (a video weighs more than a text), and the refill rate adapts AIMD-style:
+    slowly up on each success, cut down on FloodWait in proportion to its length.
+    """
+    RATE_STEP = 0.02  # additive increase per successful send
+
+    def __init__(self, rate: float, min_rate: float, max_rate: float, burst: float, weights: Dict[str, float]):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.weights = weights
+        self.tokens = burst
+        self.cooldown_until = 0.0  # wall clock, shared semantics with Telegram's FloodWait
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+        self.on_cooldown = None  # callback(cooldown_until), set in multi-instance mode
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, lane: str = "text"):
+        """Waits (FIFO) until the lane's cost is available and no FloodWait is active"""
+        cost = min(self.weights.get(lane, 1.0), self.burst)
+        async with self._lock:
+            while True:
+                wait = self.cooldown_until - time.time()
+                if wait > 0:
+                    logger.warning(f"🌊 Global FloodWait Active: Waiting {wait:.1f}s...")
+                    await asyncio.sleep(wait)
+                    continue
+                self._refill()
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+                await asyncio.sleep((cost - self.tokens) / self.rate)
+
+    def try_acquire(self, lane: str) -> bool:
+        """
+        Non-blocking take for background traffic (log shipping). Yields to any send
+        already waiting in acquire(), to FloodWait, and keeps one text token in reserve.
+        """
+        if self._lock.locked() or self.cooldown_until > time.time(): return False
+        cost = min(self.weights.get(lane, 1.0), self.burst)
+        self._refill()
+        if self.tokens < cost + self.weights.get("text", 1.0): return False
+        self.tokens -= cost
+        return True
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.RATE_STEP)
+
+    def on_flood_wait(self, seconds: int):
+        self.flood_waits += 1
+        self.flood_wait_seconds += seconds
+        self.cooldown_until = max(self.cooldown_until, time.time() + seconds + 2)
+        # Longer waits mean we overshot by more: cut 20%..50% depending on the wait
+        self.rate = max(self.min_rate, self.rate * max(0.5, 0.8 - seconds / 60))
+        self.tokens = 0
+        if self.on_cooldown: self.on_cooldown(self.cooldown_until)
+
+
+class DiscoveryRegistry:
+    """
+    LRU of chats outside the routing table: chat_id -> [title, first_seen, last_seen, pending].
+    touch() is all the event handler does per message; message counts accumulate in
+    `pending` and are written through to Mongo in batches by drain()/save_discoveries.
+    Entries idle for longer than ttl are dropped from memory (Mongo keeps them).
+    """
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, list]" = OrderedDict()
+        self._dirty: Set[int] = set()
+        self._evicted: Dict[int, list] = {}  # dropped before their counts were flushed
+
+    def __len__(self):
+        return len(self._entries)
+
+    def touch(self, chat_id: int) -> bool:
+        """Counts one message; True on the first sighting since the chat entered memory"""
+        now = time.time()
+        self._dirty.add(chat_id)
+        entry = self._entries.get(chat_id)
+        if entry is not None:
+            entry[2] = now
+            entry[3] += 1
+            self._entries.move_to_end(chat_id)
+            return False
+        evicted = self._evicted.pop(chat_id, None)
+        self._entries[chat_id] = [evicted[0], evicted[1], now, evicted[3] + 1] if evicted else [None, now, now, 1]
+        while len(self._entries) > self.max_size:
+            old_id, old = self._entries.popitem(last=False)
+            if old[3]: self._evicted[old_id] = old
+        return True
+
+    def set_title(self, chat_id: int, title: str):
+        entry = self._entries.get(chat_id)
+        if entry is not None: entry[0] = title
+
+    def load(self, chat_id: int, title: Optional[str], first_seen: float, last_seen: float):
+        """Warm-up from Mongo, oldest first; nothing pending"""
+        self._entries[chat_id] = [title, first_seen, last_seen, 0]
+        self._entries.move_to_end(chat_id)
+
+    def drain(self) -> List[tuple]:
+        """(chat_id, title, first_seen, last_seen, new_messages) per chat touched since the last drain"""
+        updates = []
+        for chat_id in self._dirty:
+            entry = self._entries.get(chat_id) or self._evicted.get(chat_id)
+            if entry and entry[3]:
+                updates.append((chat_id, entry[0], entry[1], entry[2], entry[3]))
+                entry[3] = 0
+        self._dirty.clear()
+        self._evicted.clear()
+
+        # LRU order is last_seen order, so idle entries sit at the front
+        expire_before = time.time() - self.ttl
+        while self._entries:
+            chat_id, entry = next(iter(self._entries.items()))
+            if entry[2] >= expire_before: break
+            del self._entries[chat_id]
+        return updates
+
+    def restore(self, updates: List[tuple]):
+        """Puts back the counts of a failed flush"""
+        for chat_id, title, first_seen, last_seen, pending in updates:
+            entry = self._entries.get(chat_id)
+            if entry is not None:
+                entry[3] += pending
+            else:
+                self._evicted[chat_id] = [title, first_seen, last_seen, pending]
+            self._dirty.add(chat_id)
+
+
+class EditTracker:
+    """
+    Fingerprint of recent source posts, keyed by (chat_id, msg_id), so that
+    MessageEdited events which change nothing relevant stop at the handler.
+    Proxy posts carrying configs are recorded when they arrive (seed) and keep
+    their config tokens, so an edit forwards only the configs it added. News posts are recorded from their
+    first edit on (hash of the text plus the media id), keeping NewMessage cheap.
+    """
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (expires, content, media_key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _config_tokens(text: str) -> frozenset:
+        return frozenset(t for t in text.split() if '://' in t) if '://' in text else frozenset()
+
+    def seed(self, chat_id: int, msg):
+        """
+        Baseline of a new proxy post for diffing its edits. Posts without configs need
+        none: an edit of an unknown post goes through whole, which is then exactly
+        the configs it added.
+        """
+        text = msg.text
+        if not text or '://' not in text: return
+        media = msg.document or msg.photo
+        self._entries[(chat_id, msg.id)] = (time.monotonic() + self.ttl, self._config_tokens(text),
+                                            media.id if media else None)
+        if len(self._entries) > self.max_size: self._entries.popitem(last=False)
+
+    def update(self, kind: str, chat_id: int, msg) -> Optional[tuple]:
+        """
+        Records the post's fingerprint and returns (text, media_changed) for what is new
+        since the last one, or None if nothing relevant changed. For proxy posts text is
+        only the added config tokens. Posts not in the cache count as entirely new.
+        """
+        text = msg.text or ""
+        media = msg.document or msg.photo
+        media_key = media.id if media else None
+        content = self._config_tokens(text) if kind == 'raw_proxy' else hash(text)
+
+        key = (chat_id, msg.id)
+        now = time.monotonic()
+        previous = self._entries.pop(key, None)
+        self._entries[key] = (now + self.ttl, content, media_key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+        if previous is None or previous[0] < now:
+            return text, True
+        media_changed = media_key != previous[2]
+        if kind == 'raw_proxy':
+            added = [t for t in content if t not in previous[1]]
+            if not added and not media_changed: return None
+            return "\n".join(added), media_changed
+        if content == previous[1] and not media_changed: return None
+        return text, media_changed
+
+
+class ClusterCoordinator:
+    """
+    Multi-instance mode: sources are split across processes with Mongo leases.
+    Every LEASE_HEARTBEAT each instance renews its leases, computes its fair share
+    (sources / live instances), claims free or expired leases up to that share and
+    releases the extras. A crashed instance's leases expire after LEASE_TTL and are
+    picked up by the others. The pseudo-source DISCOVERY_LEASE decides which
+    instance counts unknown chats.
+
+    FloodWait is shared through Mongo: a local hit is written out at once and every
+    instance polls the shared cooldown every COOLDOWN_SYNC_INTERVAL. The publish
+    rate ceiling is divided by the number of live instances. Cross-instance dedup
+    stays on the history _id.
+
+    Local test, one mongod and N shells (each with its own STRING_SESSION login):
+        SHARD_ENABLED=1 INSTANCE_ID=a MONGO_URI=mongodb://localhost:27017 python main.py
+    """
+    DISCOVERY_LEASE = 0
+
+    def __init__(self, db: Database, config: Config, scheduler: PublishScheduler, sources: List[int]):
+        self.db = db
+        self.instance_id = config.INSTANCE_ID
+        self.lease_ttl = config.LEASE_TTL
+        self.heartbeat = config.LEASE_HEARTBEAT
+        self.sync_interval = config.COOLDOWN_SYNC_INTERVAL
+        self.scheduler = scheduler
+        self.rate_max = config.PUBLISH_RATE_MAX
+        self.keys = [self.DISCOVERY_LEASE] + sources
+        self.owned: Set[int] = set()
+        self.live_instances = 1
+        self.on_acquire = None  # callback(chat_id) for newly owned sources (backfill)
+        self._pending: Set[asyncio.Task] = set()
+        scheduler.on_cooldown = self._share_cooldown
+
+    def owns(self, key: int) -> bool:
+        return key in self.owned
+
+    async def run(self):
+        try:
+            while True:
+                await self._rebalance()
+                await asyncio.sleep(self.heartbeat)
+        finally:
+            # Graceful stop: hand the sources over now instead of after LEASE_TTL,
+            # and stop counting towards the others' fair share
+            for key in list(self.owned):
+                await self.db.release_lease(key, self.instance_id)
+            self.owned.clear()
+            await self.db.remove_instance(self.instance_id)
+
+    async def _rebalance(self):
+        self.live_instances = max(1, await self.db.heartbeat(self.instance_id, self.lease_ttl))
+        if self.owned:
+            held = await self.db.renew_leases(list(self.owned), self.instance_id, self.lease_ttl)
+            if self.owned - held:
+                logger.warning(f"🔀 Leases lost to another instance: {sorted(self.owned - held)}")
+            self.owned = held
+
+        share = math.ceil(len(self.keys) / self.live_instances)
+        if len(self.owned) > share:
+            for key in random.sample(sorted(self.owned), len(self.owned) - share):
+                await self.db.release_lease(key, self.instance_id)
+                self.owned.discard(key)
+                logger.info(f"🔀 Released {key} (share {share} of {len(self.keys)}, {self.live_instances} instances)")
+        else:
+            free = [k for k in self.keys if k not in self.owned]
+            random.shuffle(free)  # spread concurrent claimers over different leases
+            for key in free:
+                if len(self.owned) >= share: break
+                if await self.db.claim_lease(key, self.instance_id, self.lease_ttl):
+                    self.owned.add(key)
+                    logger.info(f"🔀 Acquired {key} ({len(self.owned)}/{share})")
+                    if key != self.DISCOVERY_LEASE and self.on_acquire: self.on_acquire(key)
+
+        # The account's publish budget is split between live instances
+        self.scheduler.max_rate = self.rate_max / self.live_instances
+        self.scheduler.rate = max(self.scheduler.min_rate, min(self.scheduler.rate, self.scheduler.max_rate))
+
+    async def sync_cooldown(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            shared = await self.db.get_cooldown()
+            if shared > self.scheduler.cooldown_until:
+                logger.warning(f"🌊 Shared FloodWait from another instance: {shared - time.time():.0f}s")
+                self.scheduler.cooldown_until = shared
+                self.scheduler.tokens = 0
+
+    def _share_cooldown(self, until: float):
+        task = asyncio.create_task(self.db.share_cooldown(until))
+        self._pending.add(task)
+        task.add_done_callback(self._share_done)
+
+    def _share_done(self, task: asyncio.Task):
+        self._pending.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Shared FloodWait Write Error: {task.exception()}")
+
+
+class WorkerAutoscaler:
+    """
+    Sizing decision for the DB worker pool, taken every DB_SCALE_INTERVAL from the
+    ingest queue depth, its growth rate and the mean db_write latency over the tick.
+    Grows by half the pool on a (projected) backlog unless Mongo itself is the
+    bottleneck; shrinks by one after DB_SCALE_DOWN_TICKS quiet ticks in a row.
+    """
+    def __init__(self, config: Config):
+        self.min = max(1, config.DB_WORKERS_MIN)
+        self.max = max(self.min, config.DB_WORKERS_MAX)
+        self.up_depth = config.DB_SCALE_UP_DEPTH
+        self.down_depth = config.DB_SCALE_DOWN_DEPTH
+        self.down_ticks = config.DB_SCALE_DOWN_TICKS
+        self.horizon = config.DB_SCALE_HORIZON
+        self.latency_max = config.DB_WRITE_LATENCY_MAX
+        self._quiet = 0
+
+    def decide(self, workers: int, depth: int, growth: float, latency: Optional[float]) -> tuple:
+        """(target worker count, reason); growth in items/s, latency None if nothing was written"""
+        if workers < self.min: return self.min, "min"
+        if workers > self.max: return self.max, "max"
+        projected = depth + max(0.0, growth) * self.horizon
+        if projected >= self.up_depth:
+            self._quiet = 0
+            if latency is not None and latency > self.latency_max: return workers, "db_latency"
+            if workers < self.max: return min(self.max, workers + max(1, workers // 2)), "backlog"
+            return workers, "at_max"
+        if depth <= self.down_depth and growth <= 0:
+            self._quiet += 1
+            if self._quiet >= self.down_ticks and workers > self.min:
+                self._quiet = 0
+                return workers - 1, "idle"
+        else:
+            self._quiet = 0
+        return workers, "steady"
+
+
 class PipelineManager:
+    # ingest_wait: ingest queue | analyze: regex/cleaning/hashing | db_write: Mongo dedup write
+    # publish_wait: publish queue | send_pacing: scheduler/FloodWait | send_api: Telegram call
+    # end_to_end: ingest -> published
+    LATENCY_STAGES = ("ingest_wait", "analyze", "db_write", "publish_wait", "send_pacing", "send_api", "end_to_end")
+
     def __init__(self, client: TelegramClient, config: Config, db: Database):
         self.client = client
         self.config = config
         self.db = db
         
         # Queues
-        self.ingest_queue = asyncio.Queue(maxsize=config.INGEST_QUEUE_SIZE)
+        self.ingest_queue = PriorityIngestQueue(maxsize=config.INGEST_QUEUE_SIZE)
         self.fast_publish_queue = asyncio.Queue(maxsize=config.PUBLISH_QUEUE_SIZE)
         self.slow_publish_queue = asyncio.Queue(maxsize=config.PUBLISH_QUEUE_SIZE)
         
-        # Global Flood Control
-        self.global_flood_lock = asyncio.Lock()
-        self.flood_cooldown = 0
+        # Global Flood Control + Pacing
+        self.scheduler = PublishScheduler(
+            config.PUBLISH_RATE, config.PUBLISH_RATE_MIN, config.PUBLISH_RATE_MAX,
+            config.PUBLISH_BURST, config.PUBLISH_LANE_WEIGHTS
+        )
         
         # Metrics
         self.metrics = {
             "ingest_in": 0, "ingest_drop": 0,
             "processed_db": 0, "published": 0,
-            "discovery_log": 0, "start_time": time.time()
+            "discovery_log": 0, "near_dup_suppressed": 0,
+            "album_batches": 0, "api_calls_saved": 0,
+            "edits_skipped": 0, "spill_restored": 0,
+            "start_time": time.time()
         }
+        # Ingest overflow per priority class: shed = dropped, spilled = parked on disk
+        self.shed = {name: 0 for name in PriorityIngestQueue.CLASSES}
+        self.spilled = {name: 0 for name in PriorityIngestQueue.CLASSES}
+        # Per-stage latency, every item is stamped with ingested_at on entry
+        self.latency = {stage: LatencyHistogram() for stage in self.LATENCY_STAGES}
         
-        # Discovery Cache with Simple Memory Limit
-        self.discovery_cache: Set[int] = set()
+        # Backfill checkpoints: newest ingested message id per source chat.
+        # Chats still backfilling only persist the backfill's own position, so a
+        # crash mid-backfill never skips the part it hadn't reached yet.
+        self.checkpoints: Dict[int, int] = {}
+        self._dirty_checkpoints: Set[int] = set()
+        self.backfilling: Set[int] = set()
+
+        # Discovery registry (LRU/TTL in memory, written through to Mongo)
+        self.discovery = DiscoveryRegistry(config.DISCOVERY_CACHE_SIZE, config.DISCOVERY_TTL)
+
+        # Fingerprints of recent source posts for cheap MessageEdited handling
+        self.edits = EditTracker(config.EDIT_CACHE_SIZE, config.EDIT_CACHE_TTL)
+
+        # Multi-instance source leases and shared FloodWait
+        self.cluster = ClusterCoordinator(
+            db, config, self.scheduler, list(config.routing_table())
+        ) if config.SHARD_ENABLED else None
+
+        # Near-duplicate news index (SimHash + banded LSH)
+        self.near_dup = SimHashIndex(config.NEAR_DUP_MAX_DISTANCE, config.DUPLICATE_TTL, config.NEAR_DUP_INDEX_SIZE)
+
+        # Crash-safe journal of everything queued between stages
+        self.journal = IngestJournal(
+            config.JOURNAL_PATH, config.JOURNAL_COMMIT_MS, config.JOURNAL_FSYNC, config.JOURNAL_MAX_ENTRIES
+        ) if config.JOURNAL_ENABLED else None
+
+        # DB worker pool, resized by _db_autoscaler
+        self.autoscaler = WorkerAutoscaler(config)
+        self._db_workers: Set[asyncio.Task] = set()
+        self._db_idle: Set[asyncio.Task] = set()
+        self._db_worker_seq = 0
+        self.db_scale = {"up": 0, "down": 0, "held": 0}  # decisions; held = backlog but Mongo too slow
+        self.db_write_window = 0.0                      # mean db_write seconds over the last tick
+
+        # Overflow of the ingest queue, fed back when pressure eases
+        self.spill = SpillStore(config.SPILL_PATH, config.SPILL_MAX_ENTRIES) if config.SPILL_ENABLED else None
+
+        # Optional CPU offload for regex/cleaning/hashing
+        self._near_dup_min_tokens = config.NEAR_DUP_MIN_TOKENS if config.NEAR_DUP_ENABLED else None
+        self.offloader = ContentOffloader(
+            config.CPU_WORKERS, config.CPU_BATCH_SIZE, config.BLACKLIST, self._near_dup_min_tokens
+        ) if config.CPU_OFFLOAD else None
 
     # --- Ingestion (Zero Latency) ---
-    async def ingest(self, payload: Dict[str, Any]):
-        try:
-            self.ingest_queue.put_nowait(payload)
-            self.metrics["ingest_in"] += 1
-        except asyncio.QueueFull:
-            self.metrics["ingest_drop"] += 1
-            if self.metrics["ingest_drop"] % 50 == 0:
-                logger.warning(f"⚠️ DROP ALERT | Queue Full | Total: {self.metrics['ingest_drop']} | Source: {payload.get('source', 'unknown')}")
+    async def ingest(self, payload: IngestItem, wait: bool = False):
+        """
+        wait=True applies backpressure (backfill). Otherwise a full queue sheds its
+        lowest-priority item, which may be this one: to disk if possible, else dropped.
+        """
+        payload.ingested_at = time.monotonic()
+        if self.journal and payload.type != 'discovery':
+            payload.journal_id = self.journal.append('ingest', payload.to_record())
+        if wait:
+            await self.ingest_queue.put(payload)
+            shed = None
+        else:
+            shed = self.ingest_queue.offer(payload)
+
+        queued = shed is None or shed[1] is not payload
+        if queued: self.metrics["ingest_in"] += 1
+        spilled = self._shed(*shed) if shed else False
+        if payload.msg_id is not None and (queued or spilled):
+            self._advance_checkpoint(payload.chat_id, payload.msg_id)
+
+    def _shed(self, rank: int, item: IngestItem) -> bool:
+        """Parks an item the full ingest queue left out on disk; True if spilled, False if dropped"""
+        name = PriorityIngestQueue.CLASSES[rank]
+        # Discovery is already counted in the registry, there is nothing to keep
+        if self.spill and item.type != 'discovery' and self.spill.add(rank, item.to_record(), item.journal_id):
+            self.spilled[name] += 1
+            return True
+        if self.journal: self.journal.ack(item.journal_id)
+        self.shed[name] += 1
+        self.metrics["ingest_drop"] += 1
+        if self.metrics["ingest_drop"] % 50 == 0:
+            logger.warning(f"⚠️ DROP ALERT | Queue Full | Total: {self.metrics['ingest_drop']} | Class: {name} | Source: {item.source or 'unknown'}")
+        return False
+
+    async def _spill_drainer(self):
+        """Writes spilled items to disk and feeds them back while the ingest queue is below the resume mark"""
+        resume_at = int(self.config.INGEST_QUEUE_SIZE * self.config.SPILL_RESUME_RATIO)
+        while True:
+            await asyncio.sleep(self.config.SPILL_DRAIN_INTERVAL)
+            acked = await self.spill.flush()
+            if self.journal:
+                for journal_id in acked: self.journal.ack(journal_id)
+
+            entries = await self.spill.take(resume_at - self.ingest_queue.qsize())
+            if not entries: continue
+            messages = await self._refetch_messages([record for _, record in entries])
+            for _, record in entries:
+                msg = messages.get((record.get('chat_id'), record.get('msg_id')))
+                item = IngestItem.from_record(record, None, media_ref(msg) if msg else None)
+                if self.journal: item.journal_id = self.journal.append('ingest', item.to_record())
+                shed = self.ingest_queue.offer(item)
+                if shed: self._shed(*shed)
+                self.metrics["spill_restored"] += 1
+
+    def _publish_queue(self, p_item: PublishItem) -> asyncio.Queue:
+        return self.slow_publish_queue if (p_item.is_heavy or p_item.type == 'proxy_file') else self.fast_publish_queue
+
+    async def _dispatch(self, p_item: PublishItem):
+        p_item.queued_at = time.monotonic()
+        if self.journal: p_item.journal_id = self.journal.append('publish', p_item.to_record())
+        await self._publish_queue(p_item).put(p_item)
+
+    async def _refetch_messages(self, records: List[Dict[str, Any]]) -> Dict[tuple, Any]:
+        """(chat_id, msg_id) -> Message for the records whose media has to be re-resolved"""
+        wanted: Dict[int, Set[int]] = {}
+        for record in records:
+            if record.get('needs_message'): wanted.setdefault(record['chat_id'], set()).add(record['msg_id'])
+        messages = {}
+        for chat_id, ids in wanted.items():
+            try:
+                for msg in await self.client.get_messages(chat_id, ids=list(ids)):
+                    if msg: messages[(chat_id, msg.id)] = msg
+            except Exception as e:
+                logger.error(f"Refetch Error {chat_id}: {e}")
+        return messages
+
+    async def _replay_journal(self, entries: deque):
+        """
+        Re-queues entries left unacked by the previous run (crash, restart, deploy).
+        Runs next to the workers and publishers: a crash under load can leave more
+        entries than the queues hold. Ingest overflow goes to the spill store.
+        Entries are consumed from the deque, so a restarted replay resumes.
+        """
+        total = len(entries)
+        messages = await self._refetch_messages([record for _, _, record in entries])
+        while entries:
+            entry_id, stage, record = entries.popleft()
+            msg = messages.get((record.get('chat_id'), record.get('msg_id')))
+            media = media_ref(msg) if msg else None
+            if stage == 'ingest':
+                item = IngestItem.from_record(record, entry_id, media)
+                if self.spill:
+                    shed = self.ingest_queue.offer(item)
+                    if shed: self._shed(*shed)
+                else:
+                    await self.ingest_queue.put(item)
+                continue
+            item = PublishItem.from_record(record, entry_id, media)
+            if item.type != 'proxy_file' or item.media is not None:
+                await self._publish_queue(item).put(item)
+            else:
+                self.journal.ack(entry_id)
+        logger.info(f"♻️ Journal replay: {total} unfinished items re-queued")
+
+    def _advance_checkpoint(self, chat_id: int, msg_id: int):
+        if msg_id > self.checkpoints.get(chat_id, 0):
+            self.checkpoints[chat_id] = msg_id
+            if chat_id not in self.backfilling: self._dirty_checkpoints.add(chat_id)
+
+    def begin_backfill(self, chat_id: int):
+        """Call before live updates for chat_id can arrive, not when its backfill gets a slot"""
+        self.backfilling.add(chat_id)
+
+    def finish_backfill(self, chat_id: int):
+        self.backfilling.discard(chat_id)
+        if chat_id in self.checkpoints: self._dirty_checkpoints.add(chat_id)
+
+    async def _checkpoint_flusher(self):
+        while True:
+            await asyncio.sleep(self.config.CHECKPOINT_FLUSH_INTERVAL)
+            if not self._dirty_checkpoints: continue
+            dirty, self._dirty_checkpoints = self._dirty_checkpoints, set()
+            try:
+                await self.db.save_checkpoints({c: self.checkpoints[c] for c in dirty})
+            except Exception:
+                self._dirty_checkpoints |= dirty
+                raise
+
+    async def _discovery_flusher(self):
+        while True:
+            await asyncio.sleep(self.config.DISCOVERY_FLUSH_INTERVAL)
+            updates = self.discovery.drain()
+            if not updates: continue
+            try:
+                await self.db.save_discoveries(updates)
+            except Exception:
+                self.discovery.restore(updates)
+                raise
 
     # --- Workers Management ---
     async def start_processors(self):
         logger.info("🏭 Starting Battle-Hardened Workers...")
+
+        # Journal and spill are opened before anything can append to them
+        unfinished = deque()
+        if self.journal:
+            unfinished.extend(await self.journal.open())
+            asyncio.create_task(self._safe_runner(self.journal.run, "Journal_Writer"))
+        if self.spill:
+            await self.spill.open()
+            if self.spill.size: logger.info(f"💾 Spill: {self.spill.size} items from the previous run waiting to drain")
+
+        for chat_id, title, first_seen, last_seen in await self.db.load_discoveries(
+                self.config.DISCOVERY_CACHE_SIZE, self.config.DISCOVERY_TTL):
+            self.discovery.load(chat_id, title, first_seen, last_seen)
+
+        if self.config.NEAR_DUP_ENABLED:
+            for fp, seen_at in await self.db.load_fingerprints(self.config.NEAR_DUP_INDEX_SIZE):
+                self.near_dup.add(fp, seen_at)
+            logger.info(f"🧬 Near-dup index warmed with {len(self.near_dup)} fingerprints")
         
-        # 1. DB Worker Pool (Parallel)
-        for i in range(self.config.DB_WORKER_COUNT):
-            asyncio.create_task(self._safe_runner(self._db_processor, f"DB_Worker_{i}"))
+        # 1. DB Worker Pool (Parallel, autoscaled)
+        workers = min(max(self.config.DB_WORKER_COUNT, self.autoscaler.min), self.autoscaler.max)
+        for _ in range(workers): self._spawn_db_worker()
+        asyncio.create_task(self._safe_runner(self._db_autoscaler, "DB_Autoscaler"))
             
         # 2. Publishers
         asyncio.create_task(self._safe_runner(self._fast_publisher, "Fast_Publisher"))
@@ -278,11 +1970,38 @@ class PipelineManager:
         # 3. Metrics Monitor
         asyncio.create_task(self._safe_runner(self._monitor_metrics, "Metrics_Monitor"))
 
-    async def _safe_runner(self, func, name):
-        """Immortal Runner with Jitter"""
+        # 4. Checkpoint Writer
+        asyncio.create_task(self._safe_runner(self._checkpoint_flusher, "Checkpoint_Flusher"))
+
+        # 5. Discovery Registry Writer
+        asyncio.create_task(self._safe_runner(self._discovery_flusher, "Discovery_Flusher"))
+
+        # 6. Ingest Overflow (spill to disk and back)
+        if self.spill:
+            asyncio.create_task(self._safe_runner(self._spill_drainer, "Spill_Drainer"))
+
+        # 7. Journal Replay (consumers are running, so full queues can't stall startup)
+        if unfinished:
+            asyncio.create_task(self._safe_runner(
+                lambda: self._replay_journal(unfinished), "Journal_Replay", once=True))
+
+        # 8. Legacy history copy (one-off, resumable)
+        if self.db.legacy_history is not None:
+            asyncio.create_task(self._safe_runner(self.db.migrate_history, "History_Migration", once=True))
+
+        # 9. Cluster Leases (multi-instance mode)
+        if self.cluster:
+            asyncio.create_task(self._safe_runner(self.cluster.run, "Cluster_Leases"))
+            asyncio.create_task(self._safe_runner(self.cluster.sync_cooldown, "Cooldown_Sync"))
+
+    async def _safe_runner(self, func, name, once: bool = False):
+        """Immortal Runner with Jitter; once=True stops after the first clean return"""
+        # The task name is the stage LoopProfiler attributes samples to
+        asyncio.current_task().set_name(name)
         while True:
             try:
                 await func()
+                if once: break
             except asyncio.CancelledError: break
             except Exception as e:
                 sleep_time = random.uniform(3, 8)
@@ -290,82 +2009,192 @@ class PipelineManager:
                 await asyncio.sleep(sleep_time)
 
     # --- DB Processors ---
+    def _spawn_db_worker(self):
+        task = asyncio.create_task(self._safe_runner(self._db_processor, f"DB_Worker_{self._db_worker_seq}"))
+        self._db_worker_seq += 1
+        self._db_workers.add(task)
+        task.add_done_callback(self._db_workers.discard)
+        task.add_done_callback(self._db_idle.discard)
+
+    def _retire_db_worker(self) -> bool:
+        """Cancels a worker waiting on an empty queue (never one holding an item)"""
+        if not self._db_idle: return False
+        self._db_idle.pop().cancel()
+        return True
+
+    async def _db_autoscaler(self):
+        interval = self.config.DB_SCALE_INTERVAL
+        hist = self.latency['db_write']
+        last_depth, last_sum, last_count = self.ingest_queue.qsize(), hist.sum, hist.count
+        was_held = False
+        while True:
+            await asyncio.sleep(interval)
+            depth = self.ingest_queue.qsize()
+            growth = (depth - last_depth) / interval
+            writes = hist.count - last_count
+            latency = (hist.sum - last_sum) / writes if writes else None
+            last_depth, last_sum, last_count = depth, hist.sum, hist.count
+            if latency is not None: self.db_write_window = latency
+
+            workers = len(self._db_workers)
+            target, reason = self.autoscaler.decide(workers, depth, growth, latency)
+            held = reason == "db_latency"
+            if held: self.db_scale["held"] += 1
+            if target > workers:
+                for _ in range(target - workers): self._spawn_db_worker()
+                self.db_scale["up"] += 1
+                change = f"{workers} -> {target}"
+            elif target < workers and self._retire_db_worker():
+                target = workers - 1
+                self.db_scale["down"] += 1
+                change = f"{workers} -> {target}"
+            elif held and not was_held:
+                # Logged when a hold starts; it repeats every tick while db_write stays slow
+                change = f"held at {workers}"
+            else:
+                was_held = held
+                continue
+            was_held = held
+            write_ms = "-" if latency is None else f"{latency * 1e3:.0f}ms"
+            logger.info(f"⚙️ DB workers {change} ({reason}) | IngestQ {depth} ({growth:+.0f}/s) | db_write {write_ms}")
+
     async def _db_processor(self):
+        me = asyncio.current_task()
         while True:
-            item = await self.ingest_queue.get()
+            self._db_idle.add(me)
             try:
-                if item['type'] == 'discovery':
-                    chat_id = item['chat_id']
-                    
-                    # Memory Safety Check for Discovery Cache
-                    if len(self.discovery_cache) > 1000:
-                        self.discovery_cache.clear()
-                        logger.info("🧹 Discovery Cache Cleared (Memory Safety)")
-
-                    if chat_id not in self.discovery_cache:
-                        logger.info(f"🔍 Discovery: {item['title']} -> ID: {chat_id}")
-                        self.discovery_cache.add(chat_id)
-                        self.metrics["discovery_log"] += 1
-                    continue
+                items = [await self.ingest_queue.get()]
+            finally:
+                self._db_idle.discard(me)
+            if self.offloader:
+                # This worker's share of the backlog goes to the pool in one call
+                share = self.offloader.share(self.ingest_queue.qsize(), len(self._db_workers))
+                while len(items) < share and not self.ingest_queue.empty():
+                    items.append(self.ingest_queue.get_nowait())
+            picked_at = time.monotonic()
+            try:
+                results = await self._analyze(items)
+            except Exception as e:
+                results = [e] * len(items)
+            analyzed_at = time.monotonic()
+            for item, analyzed in zip(items, results):
+                await self._process_ingest(item, analyzed, picked_at, analyzed_at)
 
-                source = item['source']
-                to_publish = []
-                
-                # Logic
-                if item['type'] == 'raw_proxy':
-                    proxies = ContentEngine.extract_proxies(item['text'])
-                    for conf in proxies:
-                        h = ContentEngine.get_content_hash(conf)
-                        if await self.db.save_if_new(h, source):
-                            to_publish.append({'type': 'proxy_text', 'content': conf, 'source': source})
-                    
-                    if item.get('file_name'):
-                        u_id = f"{item['file_name']}_{item['file_size']}"
-                        h = ContentEngine.get_content_hash(u_id)
-                        if await self.db.save_if_new(h, source):
-                            to_publish.append({'type': 'proxy_file', 'msg_obj': item['msg_obj'], 'source': source})
-
-                elif item['type'] == 'raw_news':
-                    clean = ContentEngine.clean_news(item['text'], self.config.BLACKLIST)
-                    if clean:
-                        h = ContentEngine.get_content_hash(clean)
-                        if await self.db.save_if_new(h, source):
-                            to_publish.append({'type': 'news', 'text': clean, 'msg_obj': item['msg_obj'], 'source': source, 'is_heavy': item.get('is_heavy')})
-
-                # Dispatch
-                for p_item in to_publish:
-                    target_q = self.slow_publish_queue if (p_item.get('is_heavy') or p_item['type'] == 'proxy_file') else self.fast_publish_queue
-                    await target_q.put(p_item)
+    async def _process_ingest(self, item: IngestItem, analyzed, picked_at: float, analyzed_at: float):
+        """DB stage for one item; analyzed is its ContentEngine.analyze result (or the error)"""
+        ingested_at = item.ingested_at  # 0 on journal replay
+        if ingested_at: self.latency['ingest_wait'].observe(picked_at - ingested_at)
+        started = time.monotonic()  # later items of a batch start after the earlier ones' writes
+        try:
+            if isinstance(analyzed, Exception): raise analyzed
+            if item.type == 'discovery':
+                # First sighting since the chat entered the registry; only log chats Mongo hasn't seen either
+                if not await self.db.discovery_known(item.chat_id):
+                    logger.info(f"🔍 Discovery: {item.source} -> ID: {item.chat_id}")
+                    self.metrics["discovery_log"] += 1
+                return
+
+            source = item.source
+            to_publish = []
+            
+            # Logic
+            if item.type == 'raw_proxy':
+                found = analyzed
+                self.latency['analyze'].observe(analyzed_at - picked_at)
+                # All configs of one post go out in the same write batch
+                verdicts = await asyncio.gather(*(self.db.save_if_new(h, source) for _, h in found),
+                                                return_exceptions=True)
+                raw_keys_live = time.time() < self.db.raw_proxy_hashes_until
+                for (conf, h), is_new in zip(found, verdicts):
+                    if isinstance(is_new, Exception):
+                        # One failed save doesn't cost the post its other configs
+                        logger.error(f"DB Proc Error: {is_new}")
+                        continue
+                    if is_new and raw_keys_live:
+                        # Published before hashes were canonical: only its raw-URI key exists
+                        raw = ContentEngine.get_content_hash(conf)
+                        try:
+                            is_new = raw == h or not await self.db.seen(raw)
+                        except Exception as e:
+                            # Advisory check; the canonical key is saved, so publish rather than drop
+                            logger.error(f"DB Proc Error: {e}")
+                    if is_new:
+                        to_publish.append(PublishItem('proxy_text', source, conf, ingested_at=ingested_at))
                 
-                self.metrics["processed_db"] += 1
+                # media is None only for a replayed item whose message is gone
+                if item.file_name and item.media is not None:
+                    u_id = f"{item.file_name}_{item.file_size}"
+                    h = ContentEngine.get_content_hash(u_id)
+                    if await self.db.save_if_new(h, source):
+                        to_publish.append(PublishItem('proxy_file', source, media=item.media, chat_id=item.chat_id,
+                                                      msg_id=item.msg_id, ingested_at=ingested_at))
+                self.latency['db_write'].observe(time.monotonic() - started)
 
-            except Exception as e:
-                logger.error(f"DB Proc Error: {e}")
-            finally:
-                self.ingest_queue.task_done()
+            elif item.type == 'raw_news':
+                self.latency['analyze'].observe(analyzed_at - picked_at)
+                if analyzed:
+                    clean, h, fp = analyzed
+                    near = fp is not None and self.near_dup.find(fp) is not None
+                    # Exact dedup decides first, so a verbatim repost isn't counted as a near-dup
+                    # at distance 0. A variant's fingerprint isn't stored: the index warmed at
+                    # startup holds only published stories
+                    is_new = await self.db.save_if_new(h, source, None if near else fp)
+                    self.latency['db_write'].observe(time.monotonic() - started)
+                    if is_new:
+                        # Re-checked: another worker may have published the story during the write
+                        if near or (fp is not None and self.near_dup.find(fp) is not None):
+                            # Same story reworded/re-emojied by another channel
+                            self.metrics["near_dup_suppressed"] += 1
+                        else:
+                            # Only published stories enter the index (no await between find and add)
+                            if fp is not None: self.near_dup.add(fp)
+                            to_publish.append(PublishItem('news', source, clean, item.media, item.chat_id,
+                                                          item.msg_id, item.is_heavy, ingested_at))
 
-    # --- Global Flood Control & Retry ---
-    async def _safe_send(self, *args, **kwargs):
-        """Global Flood Aware Sender with Robust Retry"""
-        async with self.global_flood_lock:
-            now = time.time()
-            if now < self.flood_cooldown:
-                wait_time = self.flood_cooldown - now
-                logger.warning(f"🌊 Global FloodWait Active: Waiting {wait_time:.1f}s...")
-                await asyncio.sleep(wait_time)
+            # Dispatch
+            for p_item in to_publish:
+                await self._dispatch(p_item)
+            
+            self.metrics["processed_db"] += 1
 
+        except Exception as e:
+            logger.error(f"DB Proc Error: {e}")
+        finally:
+            if self.journal: self.journal.ack(item.journal_id)
+            self.ingest_queue.task_done()
+
+    async def _analyze(self, items: list) -> list:
+        """ContentEngine.analyze per item (None for discovery); one pool call when offloading"""
+        jobs = [(item.type, item.text) for item in items if item.type != 'discovery']
+        if not jobs: return [None] * len(items)
+        if self.offloader:
+            results = iter(await self.offloader.analyze_batch(jobs))
+        else:
+            results = (ContentEngine.analyze(kind, text, self.config.BLACKLIST, self._near_dup_min_tokens)
+                       for kind, text in jobs)
+        return [None if item.type == 'discovery' else next(results) for item in items]
+
+    # --- Global Flood Control & Retry ---
+    async def _safe_send(self, *args, lane: str = "text", method=None, **kwargs):
+        """Global Flood Aware Sender with Robust Retry, paced by the shared scheduler"""
+        method = method or self.client.send_message
         retries = 3
         while retries > 0:
+            started = time.monotonic()
+            await self.scheduler.acquire(lane)
+            acquired = time.monotonic()
+            self.latency['send_pacing'].observe(acquired - started)
             try:
-                return await self.client.send_message(*args, **kwargs)
+                result = await method(*args, **kwargs)
+                self.latency['send_api'].observe(time.monotonic() - acquired)
+                self.scheduler.on_success()
+                return result
             
             except errors.FloodWaitError as e:
                 # Critical: Must respect Telegram
                 logger.critical(f"🌊 GLOBAL FLOODWAIT HIT: {e.seconds}s. Locking all workers.")
-                async with self.global_flood_lock:
-                    self.flood_cooldown = time.time() + e.seconds + 2
-                await asyncio.sleep(e.seconds + 2)
-                # No retry decrement on FloodWait, we wait and retry
+                self.scheduler.on_flood_wait(e.seconds)
+                # No retry decrement on FloodWait, the scheduler holds everyone until it ends
             
             except Exception as e:
                 # Retryable Network/Server Errors
@@ -380,44 +2209,100 @@ class PipelineManager:
     async def _fast_publisher(self):
         while True:
             item = await self.fast_publish_queue.get()
+            self._observe_publish_wait(item)
             try:
-                if item['type'] == 'proxy_text':
-                    txt = f"🔑 <b>Connect to Freedom</b>\n\n<code>{item['content']}</code>{self.config.SIG_PROXY}"
+                if item.type == 'proxy_text':
+                    txt = f"🔑 <b>Connect to Freedom</b>\n\n<code>{item.text}</code>{self.config.SIG_PROXY}"
                     await self._safe_send(self.config.TARGET_CHANNEL, txt, parse_mode='html', link_preview=False)
-                elif item['type'] == 'news':
+                elif item.type == 'news':
                     await self._publish_news_item(item)
                 
                 self.metrics["published"] += 1
-                await asyncio.sleep(random.uniform(0.8, 1.5))
+                self._observe_end_to_end(item)
             finally:
+                if self.journal: self.journal.ack(item.journal_id)
                 self.fast_publish_queue.task_done()
 
     async def _slow_publisher(self):
         while True:
             item = await self.slow_publish_queue.get()
+            batch = [item]
             try:
-                if item['type'] == 'proxy_file':
-                    caption = f"📁 <b>Config File</b>\nSource: {item['source']}{self.config.SIG_PROXY}"
-                    await self._safe_send(self.config.TARGET_CHANNEL, message=caption, file=item['msg_obj'].media, parse_mode='html')
-                elif item['type'] == 'news':
-                    await self._publish_news_item(item)
-                
-                self.metrics["published"] += 1
-                await asyncio.sleep(random.uniform(2.5, 5.0))
+                # Config drops come in bursts: wait a moment so they leave as one album
+                if item.type == 'proxy_file':
+                    await self._collect_batch(self.slow_publish_queue, batch)
+                for queued in batch: self._observe_publish_wait(queued)
+
+                files = [i for i in batch if i.type == 'proxy_file']
+                if files:
+                    await self._publish_file_batch(files)
+                    self.metrics["published"] += len(files)
+                    for done in files: self._observe_end_to_end(done)
+                for news in (i for i in batch if i.type == 'news'):
+                    await self._publish_news_item(news)
+                    self.metrics["published"] += 1
+                    self._observe_end_to_end(news)
             finally:
-                self.slow_publish_queue.task_done()
+                for done in batch:
+                    if self.journal: self.journal.ack(done.journal_id)
+                    self.slow_publish_queue.task_done()
 
-    async def _publish_news_item(self, item):
-        text = item['text']
-        msg_obj = item['msg_obj']
+    def _observe_publish_wait(self, item: PublishItem):
+        if item.queued_at: self.latency['publish_wait'].observe(time.monotonic() - item.queued_at)
+
+    def _observe_end_to_end(self, item: PublishItem):
+        if item.ingested_at: self.latency['end_to_end'].observe(time.monotonic() - item.ingested_at)
+
+    async def _collect_batch(self, queue: asyncio.Queue, batch: list):
+        """Appends whatever arrives within MEDIA_BATCH_WINDOW, up to MEDIA_BATCH_MAX items"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.config.MEDIA_BATCH_WINDOW
+        while len(batch) < self.config.MEDIA_BATCH_MAX:
+            timeout = deadline - loop.time()
+            if timeout <= 0: break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    async def _publish_file_batch(self, files: list):
+        target = self.config.TARGET_CHANNEL
+        if len(files) == 1:
+            item = files[0]
+            caption = f"📁 <b>Config File</b>\nSource: {item.source}{self.config.SIG_PROXY}"
+            await self._safe_send(target, message=caption, file=item.media, parse_mode='html', lane="file")
+            return
+
+        calls = 1
+        if self.config.FORWARD_PROXY_FILES:
+            # Original captions are kept, so no re-upload is needed. One forward per source chat
+            by_chat: Dict[int, List[int]] = {}
+            for i in files: by_chat.setdefault(i.chat_id, []).append(i.msg_id)
+            for chat_id, msg_ids in by_chat.items():
+                await self._safe_send(target, msg_ids, from_peer=chat_id, drop_author=True,
+                                      method=self.client.forward_messages, lane="album")
+            calls = len(by_chat)
+        else:
+            sources = ", ".join(dict.fromkeys(i.source for i in files))
+            caption = f"📁 <b>Config Files ({len(files)})</b>\nSource: {sources}{self.config.SIG_PROXY}"
+            await self._safe_send(target, file=[i.media for i in files], caption=caption,
+                                  parse_mode='html', method=self.client.send_file, lane="album")
+
+        self.metrics["album_batches"] += 1
+        self.metrics["api_calls_saved"] += len(files) - calls
+        logger.debug(f"📦 Album batch: {len(files)} files in {calls} call(s) (saved {len(files) - calls})")
+
+    async def _publish_news_item(self, item: PublishItem):
+        text = item.text
         emoji = ContentEngine.get_emoji(text)
         header = text.split('\n')[0]
         body = '\n'.join(text.split('\n')[1:])
         caption = f"<b>{emoji} {header}</b>\n\n{body}{self.config.SIG_NEWS}"
         
-        valid_media = msg_obj.media and not isinstance(msg_obj.media, MessageMediaWebPage)
-        if valid_media:
-            await self._safe_send(self.config.TARGET_CHANNEL, message=caption, file=msg_obj.media, parse_mode='html')
+        # media is None for text posts, link previews and replayed items whose message is gone
+        if item.media is not None:
+            lane = "heavy" if item.is_heavy else "media"
+            await self._safe_send(self.config.TARGET_CHANNEL, message=caption, file=item.media, parse_mode='html', lane=lane)
         else:
             await self._safe_send(self.config.TARGET_CHANNEL, caption, parse_mode='html', link_preview=False)
 
@@ -438,22 +2323,306 @@ class PipelineManager:
                 f"FastQ: {self.fast_publish_queue.qsize()} | "
                 f"SlowQ: {self.slow_publish_queue.qsize()} | "
                 f"Drops: {self.metrics['ingest_drop']} | "
-                f"DB_Proc: {self.metrics['processed_db']} | "
-                f"Pub: {self.metrics['published']}"
+                + (f"Spill: {self.spill.backlog} | " if self.spill else "") +
+                f"DB_Proc: {self.metrics['processed_db']} ({len(self._db_workers)}w) | "
+                f"Cache: {self.db.seen_cache.hits}H/{self.db.seen_cache.misses}M | "
+                f"NearDup: {self.metrics['near_dup_suppressed']} | "
+                f"Pub: {self.metrics['published']} | "
+                f"Albums: {self.metrics['album_batches']} (-{self.metrics['api_calls_saved']} calls) | "
+                f"Rate: {self.scheduler.rate:.2f}/s (FW {self.scheduler.flood_waits})"
+                + (f" | Journal: {self.journal.size} (shed {self.journal.dropped})" if self.journal else "")
             )
 
+    def render_metrics(self) -> str:
+        """
+        Prometheus text exposition. Called from the web server thread: it only reads
+        plain ints/floats and list snapshots, so no locking against the event loop.
+        """
+        m = self.metrics
+        lines = []
+
+        def family(name: str, kind: str, help_text: str):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        family("newsradar_stage_latency_seconds", "histogram", "Per-stage pipeline latency")
+        for stage, hist in list(self.latency.items()):
+            lines.extend(hist.render("newsradar_stage_latency_seconds", f'stage="{stage}"'))
+
+        family("newsradar_items_total", "counter", "Items counted at each pipeline step")
+        for key in ("ingest_in", "ingest_drop", "processed_db", "published", "discovery_log",
+                    "near_dup_suppressed", "album_batches", "api_calls_saved", "edits_skipped",
+                    "spill_restored"):
+            lines.append(f'newsradar_items_total{{step="{key}"}} {m[key]}')
+
+        offered = m["ingest_in"] + m["ingest_drop"]
+        family("newsradar_ingest_drop_ratio", "gauge", "Share of ingested items dropped on a full queue since start")
+        lines.append(f"newsradar_ingest_drop_ratio {m['ingest_drop'] / offered if offered else 0.0:.6f}")
+
+        family("newsradar_queue_depth", "gauge", "Items waiting in each pipeline queue")
+        for name, queue in (("ingest", self.ingest_queue), ("fast_publish", self.fast_publish_queue),
+                            ("slow_publish", self.slow_publish_queue)):
+            lines.append(f'newsradar_queue_depth{{queue="{name}"}} {queue.qsize()}')
+
+        family("newsradar_ingest_class_depth", "gauge", "Ingest queue items per priority class")
+        for name, depth in zip(PriorityIngestQueue.CLASSES, self.ingest_queue.depths()):
+            lines.append(f'newsradar_ingest_class_depth{{class="{name}"}} {depth}')
+        family("newsradar_ingest_shed_total", "counter", "Ingest items dropped on a full queue, per priority class")
+        for name, count in list(self.shed.items()):
+            lines.append(f'newsradar_ingest_shed_total{{class="{name}"}} {count}')
+        family("newsradar_ingest_spilled_total", "counter", "Ingest items spilled to disk on a full queue, per priority class")
+        for name, count in list(self.spilled.items()):
+            lines.append(f'newsradar_ingest_spilled_total{{class="{name}"}} {count}')
+        if self.spill:
+            family("newsradar_spill_entries", "gauge", "Spilled ingest items waiting on disk")
+            lines.append(f"newsradar_spill_entries {self.spill.backlog}")
+
+        family("newsradar_db_workers", "gauge", "DB workers currently running")
+        lines.append(f"newsradar_db_workers {len(self._db_workers)}")
+        family("newsradar_db_scale_total", "counter", "DB worker autoscaler decisions (held: backlog but db_write too slow)")
+        for direction, count in list(self.db_scale.items()):
+            lines.append(f'newsradar_db_scale_total{{direction="{direction}"}} {count}')
+        family("newsradar_db_write_window_seconds", "gauge", "Mean db_write latency over the last autoscaler tick")
+        lines.append(f"newsradar_db_write_window_seconds {self.db_write_window:.6f}")
+
+        family("newsradar_floodwait_total", "counter", "FloodWait errors received from Telegram")
+        lines.append(f"newsradar_floodwait_total {self.scheduler.flood_waits}")
+        family("newsradar_floodwait_seconds_total", "counter", "Seconds of FloodWait imposed by Telegram")
+        lines.append(f"newsradar_floodwait_seconds_total {self.scheduler.flood_wait_seconds}")
+        family("newsradar_floodwait_remaining_seconds", "gauge", "Seconds left on the active FloodWait cooldown")
+        lines.append(f"newsradar_floodwait_remaining_seconds {max(0.0, self.scheduler.cooldown_until - time.time()):.3f}")
+        family("newsradar_publish_rate", "gauge", "Current adaptive publish rate (tokens/s)")
+        lines.append(f"newsradar_publish_rate {self.scheduler.rate:.4f}")
+
+        family("newsradar_dedup_cache_total", "counter", "Recent-hash cache lookups by result")
+        lines.append(f'newsradar_dedup_cache_total{{result="hit"}} {self.db.seen_cache.hits}')
+        lines.append(f'newsradar_dedup_cache_total{{result="miss"}} {self.db.seen_cache.misses}')
+
+        family("newsradar_discovery_tracked", "gauge", "Unknown chats currently held in the discovery registry")
+        lines.append(f"newsradar_discovery_tracked {len(self.discovery)}")
+
+        if self.cluster:
+            family("newsradar_cluster_leases", "gauge", "Sources (plus discovery) leased by this instance")
+            lines.append(f"newsradar_cluster_leases {len(self.cluster.owned)}")
+            family("newsradar_cluster_instances", "gauge", "Live instances seen at the last heartbeat")
+            lines.append(f"newsradar_cluster_instances {self.cluster.live_instances}")
+
+        if self.journal:
+            family("newsradar_journal_entries", "gauge", "Unfinished items held in the on-disk journal")
+            lines.append(f"newsradar_journal_entries {self.journal.size}")
+
+        family("newsradar_uptime_seconds", "gauge", "Seconds since the pipeline started")
+        lines.append(f"newsradar_uptime_seconds {time.time() - m['start_time']:.0f}")
+        return "\n".join(lines) + "\n"
+
 # ============================================================================
 # 6. MAIN CONTROLLER
 # ============================================================================
-backfill_done = asyncio.Event()
+def chat_title(chat) -> str:
+    """Title of a chat/channel entity, or first name for users (no network)"""
+    # اصلاح باگ: دریافت ایمن نام چت/کاربر
+    if chat is not None:
+        # اگر کانال یا گروه باشد، تایتل دارد / اگر کاربر باشد، نام کوچک دارد
+        title = getattr(chat, 'title', None) or getattr(chat, 'first_name', None)
+        if title: return title
+    return "Unknown"
+
+
+def build_payload(config: Config, route: tuple, chat_id: int, msg) -> IngestItem:
+    """
+    Ingest record for a message from a configured source (backfill and live).
+    Only the media reference a publisher may re-send is kept; msg itself is released.
+    """
+    kind, source, is_news = route
+    payload = IngestItem(kind, chat_id, msg.id, source, msg.text or "")
+    
+    if kind == 'raw_proxy':
+        if msg.file and msg.file.name:
+            file_name = msg.file.name.lower()
+            if file_name.endswith(config.PROXY_FILE_EXTENSIONS):
+                payload.file_name = file_name
+                payload.file_size = msg.file.size
+                payload.media = media_ref(msg)
+    else:
+        payload.media = media_ref(msg)
+
+    if is_news:
+        payload.is_heavy = bool(msg.video or msg.gif)
+    return payload
+
+
+def make_event_handler(config: Config, pipeline: PipelineManager):
+    """
+    Live update handler. Sources are routed with one lookup into a precomputed table;
+    messages from unknown chats are counted in the discovery registry and only a
+    chat's first sighting is queued, with the title taken from the update itself.
+    No network I/O here.
+    """
+    routes = config.routing_table()
+    discovery = pipeline.discovery
+    cluster = pipeline.cluster
+    seed_edits = pipeline.edits.seed
+
+    async def handler(event):
+        try:
+            chat_id = event.chat_id
+            route = routes.get(chat_id)
+            # Multi-instance: every instance receives every update, each keeps its leased share
+            if cluster and not cluster.owns(chat_id if route else ClusterCoordinator.DISCOVERY_LEASE): return
+            if route is None:
+                # Discovery Logic
+                if discovery.touch(chat_id):
+                    # event.chat is the entity that came with the update (None if Telegram left it out);
+                    # only its title is kept so the entity isn't held
+                    title = chat_title(event.chat)
+                    discovery.set_title(chat_id, title)
+                    await pipeline.ingest(IngestItem('discovery', chat_id, source=title))
+                return
+
+            msg = event.message
+            # Baseline for the config diff of later edits; news stays on the fast path
+            if route[0] == 'raw_proxy': seed_edits(chat_id, msg)
+            await pipeline.ingest(build_payload(config, route, chat_id, msg))
+            
+        except Exception as e:
+            logger.error(f"Handler Error: {e}")
+
+    return handler
+
+
+def make_edit_handler(config: Config, pipeline: PipelineManager):
+    """
+    MessageEdited handler for source chats: only what an edit changed goes
+    downstream (see EditTracker). A news post's first edit goes through whole;
+    the exact-hash dedup catches it if nothing changed.
+    """
+    routes = config.routing_table()
+    cluster = pipeline.cluster
+    edits = pipeline.edits
+    metrics = pipeline.metrics
+
+    async def handler(event):
+        try:
+            chat_id = event.chat_id
+            route = routes.get(chat_id)
+            # Edits in unknown chats are not new activity
+            if route is None or (cluster and not cluster.owns(chat_id)): return
+
+            msg = event.message
+            changed = edits.update(route[0], chat_id, msg)
+            if changed is None:
+                # Reactions, typo-free link tweaks, formatting: nothing the pipeline cares about
+                metrics["edits_skipped"] += 1
+                return
+
+            payload = build_payload(config, route, chat_id, msg)
+            payload.text, media_changed = changed
+            # Unchanged config file was handled with the original post
+            if route[0] == 'raw_proxy' and not media_changed: payload.file_name = payload.media = None
+            await pipeline.ingest(payload)
+
+        except Exception as e:
+            logger.error(f"Edit Handler Error: {e}")
+
+    return handler
+
+
+async def backfill_chat(client: TelegramClient, config: Config, db: Database,
+                        pipeline: PipelineManager, chat_id: int, limiter: asyncio.Semaphore):
+    """
+    The caller has already marked chat_id with pipeline.begin_backfill(). A failed pass
+    is retried from the last message it ingested. Only a completed pass hands the chat
+    back to the live checkpoint (finish_backfill); if every attempt fails it stays
+    marked, so the next start resumes from the backfill's own position.
+    """
+    async with limiter:
+        route = config.routing_table()[chat_id]
+        now = datetime.now(timezone.utc)
+        last_id, count, completed = None, 0, False
+        try:
+            for attempt in range(1, config.BACKFILL_RETRIES + 1):
+                try:
+                    if last_id is None:
+                        checkpoint = await db.get_checkpoint(chat_id)
+                        if checkpoint and checkpoint["updated_at"] > now - timedelta(hours=config.BACKFILL_MAX_GAP_HOURS):
+                            last_id = checkpoint["last_id"]
+                    if last_id is not None:
+                        # Resume right after the last message we ingested
+                        messages = client.iter_messages(chat_id, min_id=last_id, reverse=True)
+                    else:
+                        hours = config.BACKFILL_MAX_GAP_HOURS if checkpoint else config.BACKFILL_WINDOW_HOURS
+                        messages = client.iter_messages(chat_id, offset_date=now - timedelta(hours=hours), reverse=True)
+
+                    async for msg in messages:
+                        if route[0] == 'raw_proxy': pipeline.edits.seed(chat_id, msg)
+                        await pipeline.ingest(build_payload(config, route, chat_id, msg), wait=True)
+                        last_id, count = msg.id, count + 1
+                        if count % config.BACKFILL_CHECKPOINT_EVERY == 0:
+                            await db.save_checkpoints({chat_id: last_id})
+
+                    logger.info(f"✅ Backfill pushed for {chat_id} ({count} msgs)")
+                    completed = True
+                    break
+                except Exception as e:
+                    logger.error(f"Backfill Error {chat_id} (attempt {attempt}/{config.BACKFILL_RETRIES}): {e}")
+                    if attempt < config.BACKFILL_RETRIES: await asyncio.sleep(random.uniform(3, 8))
+        finally:
+            try:
+                if count: await db.save_checkpoints({chat_id: last_id})
+            except Exception as e:
+                logger.error(f"Checkpoint Save Error {chat_id}: {e}")
+            if completed:
+                pipeline.finish_backfill(chat_id)
+            else:
+                logger.warning(f"⚠️ Backfill of {chat_id} stopped at {last_id}; it resumes there on the next start")
+
+
+async def backfill_sources(client: TelegramClient, config: Config, db: Database, pipeline: PipelineManager):
+    started = time.time()
+    all_source_ids = list(dict.fromkeys(list(config.NEWS_SOURCES) + list(config.PROXY_SOURCES)))
+    
+    if not all_source_ids: logger.warning("⚠️ No IDs in Config! Discovery Mode Active.")
+
+    limiter = asyncio.Semaphore(config.BACKFILL_CONCURRENCY)
+    await asyncio.gather(*(backfill_chat(client, config, db, pipeline, chat_id, limiter) for chat_id in all_source_ids))
+    logger.info(f"✅ Backfill Complete in {time.time() - started:.1f}s.")
+
 
 async def main():
     config = Config.from_env()
-    db = Database(config.MONGO_URI)
+    if config.PROFILE_TOKEN:
+        profiler = LoopProfiler(config.PROFILE_DIR, config.PROFILE_INTERVAL_MS,
+                                config.PROFILE_SLOW_MS, config.PROFILE_MAX_SECONDS)
+        profiler.attach(asyncio.get_running_loop())
+        register_profiler(profiler.profile, config.PROFILE_TOKEN)
+    # After every route is registered
+    keep_alive()
+
+    db = Database(config.MONGO_URI, config.DEDUP_CACHE_SIZE,
+                  config.HISTORY_BATCH_SIZE, config.HISTORY_BATCH_LINGER_MS,
+                  config.DB_WORKERS_MIN, config.DB_WORKERS_MAX)
     await db.initialize()
     
     client = TelegramClient(StringSession(config.STRING_SESSION), config.API_ID, config.API_HASH)
     pipeline = PipelineManager(client, config, db)
+    register_metrics_provider(pipeline.render_metrics)
+
+    backfills: Set[asyncio.Task] = set()
+    if pipeline.cluster:
+        # Each source is backfilled when its lease is acquired, resuming from the shared checkpoint
+        limiter = asyncio.Semaphore(config.BACKFILL_CONCURRENCY)
+
+        def backfill_acquired(chat_id: int):
+            # Marked now, while the backfill may still wait on the limiter
+            pipeline.begin_backfill(chat_id)
+            task = asyncio.create_task(backfill_chat(client, config, db, pipeline, chat_id, limiter))
+            backfills.add(task)
+            task.add_done_callback(backfills.discard)
+        pipeline.cluster.on_acquire = backfill_acquired
+    else:
+        # Live updates start before the backfills get a limiter slot; until a chat's
+        # backfill is done its checkpoint must not move to a live message id
+        for chat_id in config.routing_table(): pipeline.begin_backfill(chat_id)
     
     await client.start()
     
@@ -462,11 +2631,13 @@ async def main():
     # ------------------------------------------------------------
     if config.LOG_CHANNEL_ID:
         try:
-            tg_handler = TelegramLogHandler(client, config.LOG_CHANNEL_ID)
+            tg_handler = TelegramLogHandler(client, config.LOG_CHANNEL_ID, pipeline.scheduler,
+                                            config.LOG_FLUSH_INTERVAL, config.LOG_BUFFER_SIZE)
             tg_handler.setLevel(logging.INFO) # فقط لاگ‌های مهم و اطلاعاتی
             formatter = logging.Formatter('<b>%(levelname)s</b>: %(message)s')
             tg_handler.setFormatter(formatter)
             logger.addHandler(tg_handler)
+            asyncio.create_task(pipeline._safe_runner(tg_handler.run, "Log_Shipper"))
             logger.info(f"✅ لاگ‌های سیستم به کانال {config.LOG_CHANNEL_ID} متصل شد.")
         except Exception as e:
             print(f"خطا در اتصال لاگ تلگرام: {e}")
@@ -474,99 +2645,19 @@ async def main():
 
     await pipeline.start_processors()
 
-    logger.info("⏳ Starting Backfill...")
-    one_hour_ago = datetime.now(timezone.utc) - timedelta(hours=1)
-    
-    all_source_ids = list(config.NEWS_SOURCES.keys()) + list(config.PROXY_SOURCES.keys())
-    
-    if not all_source_ids: logger.warning("⚠️ No IDs in Config! Discovery Mode Active.")
+    client.add_event_handler(make_event_handler(config, pipeline), events.NewMessage())
+    client.add_event_handler(make_edit_handler(config, pipeline), events.MessageEdited())
 
-    for chat_id in all_source_ids:
-        try:
-            async for msg in client.iter_messages(chat_id, offset_date=one_hour_ago, reverse=True):
-                source = config.NEWS_SOURCES.get(chat_id) or config.PROXY_SOURCES.get(chat_id)
-                
-                payload = {
-                    'source': source,
-                    'text': msg.text or "",
-                    'msg_obj': msg,
-                    'type': 'unknown'
-                }
-                
-                if chat_id in config.PROXY_SOURCES:
-                    payload['type'] = 'raw_proxy'
-                    if msg.file and msg.file.name:
-                        if any(msg.file.name.lower().endswith(ext) for ext in config.PROXY_FILE_EXTENSIONS):
-                            payload['file_name'] = msg.file.name.lower()
-                            payload['file_size'] = msg.file.size
-                
-                elif chat_id in config.NEWS_SOURCES:
-                    payload['type'] = 'raw_news'
-                    payload['is_heavy'] = bool(msg.video or msg.gif)
-
-                await pipeline.ingest(payload)
-                await asyncio.sleep(0.01)
-                
-            logger.info(f"✅ Backfill pushed for {chat_id}")
-        except Exception as e:
-            logger.error(f"Backfill Error {chat_id}: {e}")
-
-    logger.info("✅ Backfill Complete. Live Mode ON.")
-    backfill_done.set()
-
-    @client.on(events.NewMessage())
-    @client.on(events.MessageEdited())   # <--- این خط اضافه شود
-    async def handler(event):
-        if not backfill_done.is_set(): return 
-        try:
-            chat_id = event.chat_id
-            
-            # Fast Check
-            is_proxy = chat_id in config.PROXY_SOURCES
-            is_news = chat_id in config.NEWS_SOURCES
-            
-# Discovery Logic
-            if not is_proxy and not is_news:
-                # اصلاح باگ: دریافت ایمن نام چت/کاربر
-                chat_title = "Unknown"
-                if event.chat:
-                    # اگر کانال یا گروه باشد، تایتل دارد
-                    if hasattr(event.chat, 'title'):
-                        chat_title = event.chat.title
-                    # اگر کاربر باشد، نام کوچک دارد
-                    elif hasattr(event.chat, 'first_name'):
-                        chat_title = event.chat.first_name
-                
-                await pipeline.ingest({'type': 'discovery', 'chat_id': chat_id, 'title': chat_title or "Unknown"})
-                return
-                
-
-            source = config.PROXY_SOURCES.get(chat_id) or config.NEWS_SOURCES.get(chat_id)
-            
-            payload = {
-                'source': source,
-                'text': event.message.text or "",
-                'msg_obj': event.message,
-                'type': 'raw_proxy' if is_proxy else 'raw_news'
-            }
-            
-            if is_proxy and event.message.file and event.message.file.name:
-                if any(event.message.file.name.lower().endswith(ext) for ext in config.PROXY_FILE_EXTENSIONS):
-                    payload['file_name'] = event.message.file.name.lower()
-                    payload['file_size'] = event.message.file.size
-
-            if is_news:
-                 payload['is_heavy'] = bool(event.message.video or event.message.gif)
-
-            await pipeline.ingest(payload)
-            
-        except Exception as e:
-            logger.error(f"Handler Error: {e}")
+    # Live mode is on from here; backfill catches up in the background
+    if not pipeline.cluster:
+        logger.info("⏳ Starting Backfill... Live Mode ON.")
+        backfills.add(asyncio.create_task(backfill_sources(client, config, db, pipeline)))
+    else:
+        logger.info(f"⏳ Live Mode ON as instance {config.INSTANCE_ID}; sources backfill as leases are acquired.")
 
     await client.run_until_disconnected()
 
 if __name__ == "__main__":
-    keep_alive()
     try:
         asyncio.run(main())
     except KeyboardInterrupt: pass
@@ -1,12 +1,47 @@
-from flask import Flask
+import hmac
+
+from flask import Flask, Response, jsonify, request
 from threading import Thread
 
 app = Flask('')
 
+# Callables returning Prometheus text; registered by main.py so this module never imports it
+_metrics_providers = []
+
+def register_metrics_provider(provider):
+    _metrics_providers.append(provider)
+
+# Event-loop profiler (blocking callable taking seconds) and the token that unlocks it
+_profiler = None
+_profiler_token = ""
+
+def register_profiler(profile, token):
+    # Adds /debug/profile, so it must run before keep_alive(): Flask takes no new routes once serving
+    global _profiler, _profiler_token
+    if not token: return
+    _profiler, _profiler_token = profile, token
+    app.add_url_rule('/debug/profile', 'profile', profile_view)
+
 @app.route('/')
 def home():
     return "NewsRadar v6.4 System Online 🛰️"
 
+@app.route('/metrics')
+def metrics():
+    body = "".join(provider() for provider in _metrics_providers)
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def profile_view():
+    # Not advertised without the right token
+    token = request.args.get('token', '')
+    if not hmac.compare_digest(token.encode(), _profiler_token.encode()):
+        return Response("Not Found", status=404)
+    try:
+        seconds = float(request.args.get('seconds', 10))
+    except ValueError:
+        return Response("seconds must be a number", status=400)
+    return jsonify(_profiler(seconds))
+
 def run():
     app.run(host='0.0.0.0', port=8080)
 